@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from config import ANNOTATION_CACHE_PATH
+from mask_codec import CompactMask
+
+#this file caches annotation results per image on local disk so photos shared between datasets are only processed once
+#entries are keyed by the image content hash plus a fingerprint of the models and generator settings that produced them,
+#each entry holds the compact masks of the image and the tree confidence every ensemble model gave each mask
+
+
+# seconds a write waits for another process holding the database before giving up
+BUSY_TIMEOUT = 60
+
+
+#identifies a checkpoint file by path, size and modification time
+def file_signature(path):
+    try:
+        stat = os.stat(path)
+        return [path, stat.st_size, int(stat.st_mtime)]
+    except OSError:
+        return [path, None, None]
+
+#hash of the settings that decide what masks and scores an image gets
+#settings: json serialisable dict, checkpoint_paths: files whose changes should invalidate the cache
+def settings_fingerprint(settings, checkpoint_paths=()):
+    payload = {
+        "settings": settings,
+        "checkpoints": [file_signature(path) for path in checkpoint_paths],
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+#turns SAM2 masks with compact segmentations and ensemble scores into a storable record
+def masks_to_record(masks, image_shape):
+    return {
+        "image_shape": list(image_shape[:2]),
+        "masks": [
+            {
+                "rle": mask["segmentation"].to_rle(),
+                "bbox": list(mask["bbox"]) if "bbox" in mask else None,
+                "area": mask.get("area"),
+                "stability_score": mask.get("stability_score"),
+                "scores": mask.get("scores", {}),
+            }
+            for mask in masks
+        ],
+    }
+
+#rebuilds the masks of a record in the same shape annotate_dataset uses
+def record_to_masks(record):
+    masks = []
+    for stored in record["masks"]:
+        mask = {
+            "segmentation": CompactMask.from_rle(stored["rle"]),
+            "area": stored["area"],
+            "stability_score": stored["stability_score"],
+            "scores": dict(stored["scores"]),
+        }
+        if stored["bbox"] is not None:
+            mask["bbox"] = stored["bbox"]
+        masks.append(mask)
+    return masks
+
+
+#persistent store of annotation results backed by sqlite
+class AnnotationCache:
+    def __init__(self, path=ANNOTATION_CACHE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        # every annotation worker process opens the same file, WAL lets them read while one writes
+        # and the busy timeout makes a writer wait for another instead of failing with "database is locked"
+        self._connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS annotation_results ("
+            " content_hash TEXT NOT NULL,"
+            " fingerprint TEXT NOT NULL,"
+            " record TEXT NOT NULL,"
+            " updated REAL NOT NULL,"
+            " PRIMARY KEY (content_hash, fingerprint))"
+        )
+        self._connection.commit()
+        self.hits = 0
+        self.misses = 0
+
+    #returns the stored record for an image or None
+    def get(self, content_hash, fingerprint):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT record FROM annotation_results WHERE content_hash = ? AND fingerprint = ?",
+                (content_hash, fingerprint),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+
+    #stores the masks and scores of an image, replacing anything stored before
+    def put(self, content_hash, fingerprint, masks, image_shape):
+        record = json.dumps(masks_to_record(masks, image_shape))
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO annotation_results (content_hash, fingerprint, record, updated) VALUES (?, ?, ?, ?)",
+                (content_hash, fingerprint, record, time.time()),
+            )
+            self._connection.commit()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,129 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import db
+from config import DMS_CONCURRENCY
+
+#this file is the asyncio counterpart of db.py for annotations, dataset photos and model metadata
+#calls run on a thread pool over the pooled DMS client, so many small requests are in flight at once
+#instead of paying one round trip after another, the pool size caps how many run at the same time
+#sync callers use the *_many functions at the bottom, which run the async calls to completion
+
+
+#asyncio client for the DMS with bounded concurrency
+class AsyncDMS:
+    def __init__(self, concurrency=DMS_CONCURRENCY):
+        self.concurrency = concurrency
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="dms")
+
+    #runs a blocking db function on the client's threads
+    async def call(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: fn(*args, **kwargs))
+
+    #calls fn on every item concurrently, at most limit at once, results are in item order
+    #limit may not be above the client's concurrency, the thread pool could not run that many at once
+    #return_exceptions: errors are returned in place of results instead of raising the first one
+    async def map(self, fn, items, limit=None, return_exceptions=False):
+        limit = limit or self.concurrency
+        if limit > self.concurrency:
+            raise ValueError(f"limit of {limit} is above the {self.concurrency} concurrent calls of the DMS client, raise DMS_CONCURRENCY")
+        semaphore = asyncio.Semaphore(limit)
+
+        async def bounded(item):
+            async with semaphore:
+                return await self.call(fn, item)
+
+        return await asyncio.gather(*(bounded(item) for item in items), return_exceptions=return_exceptions)
+
+    ######################## Annotation Interactions ########################
+
+    async def get_annotations(self, photo_id):
+        return await self.call(db.get_annotations, photo_id)
+
+    #returns dict of photo_id -> annotations
+    async def get_annotations_many(self, photo_ids, limit=None):
+        photo_ids = list(photo_ids)
+        annotations = await self.map(db.get_annotations, photo_ids, limit)
+        return dict(zip(photo_ids, annotations))
+
+    async def get_annotation_classes(self, photo_ids):
+        return await self.call(db.get_annotation_classes, photo_ids)
+
+    async def upload_annotations(self, photo_id, classes, annotation):
+        return await self.call(db.upload_annotations, photo_id, classes, annotation)
+
+    #param: entries: list of dicts with photo_id, classes and annotation
+    #with return_exceptions returns the error of each entry in entry order, None for entries that were uploaded
+    async def upload_annotations_many(self, entries, limit=None, return_exceptions=False):
+        def upload(entry):
+            return db.upload_annotations(entry["photo_id"], entry["classes"], entry["annotation"])
+        return await self.map(upload, entries, limit, return_exceptions)
+
+    ######################## Datset Interactions ########################
+
+    async def load_dataset_photos(self, dataset_id):
+        return await self.call(db.load_dataset_photos, dataset_id)
+
+    async def get_classes(self, dataset_id):
+        return await self.call(db.get_classes, dataset_id)
+
+    async def get_dataset_id(self, dataset_name):
+        return await self.call(db.get_dataset_id, dataset_name)
+
+    async def remove_photo_from_dataset(self, dataset_id, photo_id):
+        return await self.call(db.remove_photo_from_dataset, dataset_id, photo_id)
+
+    #photos that are no longer in the dataset count as removed
+    #with return_exceptions returns the error of each photo in photo order, None for photos that were removed
+    async def remove_photos_many(self, dataset_id, photo_ids, limit=None, return_exceptions=False):
+        def remove(photo_id):
+            return db.remove_photo_from_dataset(dataset_id, photo_id, missing_ok=True)
+        return await self.map(remove, photo_ids, limit, return_exceptions)
+
+    ######################## Model Interactions ########################
+
+    async def get_all_models(self):
+        return await self.call(db.get_all_models)
+
+    async def get_all_model_names(self):
+        return await self.call(db.get_all_model_names)
+
+    async def model_name_exists(self, model_name):
+        return await self.call(db.model_name_exists, model_name)
+
+    async def get_model_path(self, model_name):
+        return await self.call(db.get_model_path, model_name)
+
+    #returns dict of model_name -> weights path
+    async def get_model_paths_many(self, model_names, limit=None):
+        model_names = list(model_names)
+        paths = await self.map(db.get_model_path, model_names, limit)
+        return dict(zip(model_names, paths))
+
+
+#process wide async client
+async_dms = AsyncDMS()
+
+
+######################## Sync adapter ########################
+
+#runs a coroutine to completion from sync code, must not be called from inside a running event loop
+def run_sync(coroutine):
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    coroutine.close()
+    raise RuntimeError("run_sync was called from a running event loop, await the coroutine instead")
+
+def get_annotations_many(photo_ids, limit=None):
+    return run_sync(async_dms.get_annotations_many(photo_ids, limit))
+
+def upload_annotations_many(entries, limit=None, return_exceptions=False):
+    return run_sync(async_dms.upload_annotations_many(entries, limit, return_exceptions))
+
+def remove_photos_many(dataset_id, photo_ids, limit=None, return_exceptions=False):
+    return run_sync(async_dms.remove_photos_many(dataset_id, photo_ids, limit, return_exceptions))
+
+def get_model_paths_many(model_names, limit=None):
+    return run_sync(async_dms.get_model_paths_many(model_names, limit))
@@ -0,0 +1,145 @@
+import queue
+import random
+import threading
+import time
+
+#this file sends items to the DMS in batches from a background thread so the caller never waits on the network
+#items are coalesced until batch_size is reached or max_wait seconds pass, failed batches are retried with backoff
+#flush() returns once everything submitted so far has been sent, close() flushes and stops the thread
+
+
+_STOP = object()
+
+
+#background sender of batched requests
+#send_batch: called with a list of items, retry_on: exception types worth retrying,
+#on_sent: called with each item once its batch was sent
+#when only part of a batch was sent, send_batch raises an error with a remaining attribute listing the items still to send,
+#the others count as sent and only the remaining ones are retried
+class BatchSender:
+    def __init__(self, send_batch, batch_size=64, max_wait=0.5, retries=5, backoff=1.0, retry_on=(), on_sent=None, name="batch sender"):
+        self.send_batch = send_batch
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.retries = retries
+        self.backoff = backoff
+        self.retry_on = tuple(retry_on)
+        self.on_sent = on_sent
+        self.name = name
+
+        self.sent = 0
+        self.batches = 0
+        self.retried = 0
+
+        self._queue = queue.Queue()
+        self._condition = threading.Condition()
+        self._pending = 0
+        self._error = None
+        self._closed = False
+        self._aborted = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        with self._condition:
+            self._raise_error()
+            if self._closed:
+                raise Exception(f"{self.name} is closed")
+            self._pending += 1
+        self._queue.put(item)
+
+    #blocks until every submitted item was sent, raises the error that stopped the sender if there was one
+    def flush(self):
+        with self._condition:
+            while self._pending and self._error is None:
+                self._condition.wait()
+            self._raise_error()
+
+    #flushes then stops the background thread
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.stop()
+
+    #stops the background thread, items not sent yet are dropped
+    def stop(self):
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._aborted = self._pending > 0
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise Exception(f"{self.name} failed: {self._error}") from self._error
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+
+            batch = [item]
+            stop = False
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+
+            if self._aborted:
+                return
+            try:
+                self._send(batch)
+            except Exception as e:
+                with self._condition:
+                    self._error = e
+                    self._condition.notify_all()
+                return
+
+            with self._condition:
+                self.batches += 1
+            if stop:
+                return
+
+    def _send(self, batch):
+        attempt = 0
+        while True:
+            try:
+                self.send_batch(batch)
+                self._delivered(batch)
+                return
+            except Exception as e:
+                remaining = getattr(e, "remaining", None)
+                if remaining is not None:
+                    left = {id(item) for item in remaining}
+                    self._delivered([item for item in batch if id(item) not in left])
+                    batch = [item for item in batch if id(item) in left]
+                if not isinstance(e, self.retry_on) or attempt >= self.retries or self._aborted:
+                    raise
+                # exponential backoff with jitter so several senders do not retry in step
+                delay = self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+                print(f"{self.name}: batch of {len(batch)} failed ({e}), retrying in {delay:.1f} seconds")
+                self.retried += 1
+                attempt += 1
+                time.sleep(delay)
+
+    def _delivered(self, items):
+        if self.on_sent is not None:
+            for item in items:
+                self.on_sent(item)
+        with self._condition:
+            self._pending -= len(items)
+            self.sent += len(items)
+            self._condition.notify_all()
@@ -0,0 +1,231 @@
+import argparse
+import json
+import random
+import sys
+import time
+import traceback
+from config import ANNOTATION_WORKERS
+from job_callbacks import TrainingCallbacks, ValidationCallbacks
+from sam2_presets import SAM2_PRESETS, DEFAULT_SAM2_PRESET
+from shard_annotater import parse_shard
+
+#this file runs annotate, train and validate without the GUI so they can be scheduled on headless servers
+#PyQt is never imported, progress is written to stdout as one JSON object per line and anything else printed goes to stderr
+#run from the IPS folder:
+#   python cli.py annotate --dataset-id <id>
+#   python cli.py annotate --create <name> --filters filters.json --split 70/20/10
+#   python cli.py train --dataset <name> --config train.json --save
+#   python cli.py validate --model <model name> --dataset <name>
+
+# exit codes
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2  # also used by argparse for bad arguments
+EXIT_DMS_UNAVAILABLE = 3  # the DMS could not be reached, the job can be retried as is
+EXIT_INTERRUPTED = 130
+
+
+#bad input found after argument parsing
+class UsageError(Exception):
+    pass
+
+
+def _json_value(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return str(value)
+
+#writes progress events as JSON lines
+class EventWriter:
+    def __init__(self, stream):
+        self.stream = stream
+        self.errors = []
+
+    def write(self, event, **fields):
+        fields = {"event": event, "time": time.time(), **fields}
+        self.stream.write(json.dumps(fields, default=_json_value) + "\n")
+        self.stream.flush()
+
+    def progress(self, message, finished=False):
+        self.write("progress", message=message, finished=finished)
+
+    def error(self, message):
+        self.errors.append(message)
+        self.write("error", message=message)
+
+#stands in for a pyqtSignal, emitting writes an event instead, listener is called with the payload first
+class EventSignal:
+    def __init__(self, events, event, listener=None):
+        self.events = events
+        self.event = event
+        self.listener = listener
+
+    def emit(self, payload):
+        if self.listener is not None:
+            self.listener(payload)
+        if self.event == "error":
+            self.events.error(payload)
+        elif isinstance(payload, dict):
+            self.events.write(self.event, data=payload)
+        else:
+            self.events.write(self.event, message=payload)
+
+
+#receives ultralytics validation callbacks without Qt
+class HeadlessValidator(ValidationCallbacks):
+    def __init__(self, events):
+        self.status_update = EventSignal(events, "status")
+        self.validation_finished = EventSignal(events, "validation_finished")
+        self.error_occurred = EventSignal(events, "error")
+
+#receives ultralytics training callbacks without Qt
+class HeadlessTrainer(TrainingCallbacks):
+    def __init__(self, events, config):
+        self.reset_progress(config)
+        self.training_started = EventSignal(events, "status")
+        self.epoch_completed = EventSignal(events, "epoch_completed")
+        self.training_finished = EventSignal(events, "training_finished")
+        self.error_occurred = EventSignal(events, "error")
+        self.status_update = EventSignal(events, "status")
+        self.prepare_save = EventSignal(events, "model_ready", self.keep_results)
+        self.results_doc = None
+
+    # keeps the document the GUI would save so --save can upload it
+    def keep_results(self, doc):
+        self.results_doc = doc
+
+
+#true if an error, or an error it was raised from, means the DMS could not be reached or did not answer in time
+#errors from the background senders arrive wrapped, with the DMS error as their cause
+def dms_unavailable(error):
+    import requests
+
+    while error is not None:
+        if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+            return True
+        error = error.__cause__
+    return False
+
+
+def _read_json(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def run_annotate(args, events):
+    import db
+    import dataset_annotater
+
+    if args.create:
+        if args.filters is None or args.split is None:
+            raise UsageError("--create needs --filters and --split")
+        if not db.validate_dataset_name(args.create):
+            raise UsageError(f"Dataset name {args.create} is taken")
+        dataset_id = db.create_dataset(args.create, _read_json(args.filters), args.split, args.classes)
+        events.write("dataset_created", dataset_id=dataset_id, name=args.create)
+    else:
+        dataset_id = args.dataset_id
+
+    stats = dataset_annotater.annotate_dataset(dataset_id, events.progress, preset=args.preset,
+                                               workers=args.workers, shard=args.shard)
+    events.write("annotation_finished", dataset_id=dataset_id, data=stats or {})
+
+def run_train(args, events):
+    import db
+    import model_trainer
+    from system import system_instance
+
+    config = _read_json(args.config)
+    if "model" not in config or "name" not in config:
+        raise UsageError("training config needs a model and a name")
+    if db.model_name_exists(config["name"]):
+        raise UsageError(f"Model name {config['name']} is taken")
+
+    #generate random seed if one hasint been provided, same as the training form
+    if not config.get("seed"):
+        config["seed"] = random.randint(0, 2**32 - 1)
+
+    events.progress("Loading Dataset")
+    system_instance.change_dataset(db.get_dataset_id(args.dataset))
+
+    trainer = HeadlessTrainer(events, config)
+    model_trainer.train_model(model_trainer.complete_config(config.copy()), trainer)
+
+    if args.save and not events.errors:
+        if trainer.results_doc is None:
+            raise RuntimeError("Training finished without results to save")
+        db.save_model(trainer.results_doc,
+                      progress_callback=lambda sent, total: events.write("upload_progress", sent=sent, total=total))
+        events.write("model_saved", name=trainer.results_doc["name"])
+
+def run_validate(args, events):
+    import model_validator
+
+    model_validator.validate_model(args.model, args.dataset, HeadlessValidator(events))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Run IPS jobs without the GUI, progress is written to stdout as JSON lines")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    annotate = commands.add_parser("annotate", help="create and annotate a dataset, or annotate an existing one")
+    target = annotate.add_mutually_exclusive_group(required=True)
+    target.add_argument("--dataset-id", help="id of an existing dataset to annotate or resume")
+    target.add_argument("--create", metavar="NAME", help="name of a new dataset to create from --filters")
+    annotate.add_argument("--filters", help="JSON file of photo filters, same shape the create dataset form sends")
+    annotate.add_argument("--split", help="train/test/val split, e.g. 70/20/10")
+    annotate.add_argument("--classes", default="tree")
+    annotate.add_argument("--preset", default=DEFAULT_SAM2_PRESET, choices=list(SAM2_PRESETS))
+    annotate.add_argument("--workers", type=int, default=ANNOTATION_WORKERS, help="annotation worker processes")
+    annotate.add_argument("--shard", type=parse_shard, default=None, help="index/count, annotate one shard of the dataset")
+
+    train = commands.add_parser("train", help="train a model on a dataset")
+    train.add_argument("--dataset", required=True, help="name of the dataset to train on")
+    train.add_argument("--config", required=True, help="JSON file with model, name and any ultralytics training arguments")
+    train.add_argument("--save", action="store_true", help="save the trained model to the DMS")
+
+    validate = commands.add_parser("validate", help="validate a model against a dataset")
+    validate.add_argument("--model", required=True, help="name of the model")
+    validate.add_argument("--dataset", required=True, help="name of the dataset")
+
+    return parser
+
+COMMANDS = {"annotate": run_annotate, "train": run_train, "validate": run_validate}
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    # stdout only carries events, prints from the jobs go to stderr
+    events = EventWriter(sys.stdout)
+    sys.stdout = sys.stderr
+
+    events.write("started", command=args.command)
+    try:
+        COMMANDS[args.command](args, events)
+    except KeyboardInterrupt:
+        events.error("Interrupted")
+        return EXIT_INTERRUPTED
+    except UsageError as e:
+        events.error(str(e))
+        return EXIT_USAGE
+    except Exception as e:
+        print(traceback.format_exc())
+        if dms_unavailable(e):
+            events.error(f"Could not reach the DMS: {e}")
+            return EXIT_DMS_UNAVAILABLE
+        events.error(str(e))
+        return EXIT_FAILED
+    finally:
+        sys.stdout = events.stream
+
+    if events.errors:
+        return EXIT_FAILED
+    import db
+    events.write("finished", command=args.command, dms=db.pool_stats(), metadata_cache=db.metadata_cache_stats())
+    return EXIT_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,3 +1,83 @@
 #config for working directory and 
 WORKING_DIR = "/home/dj66/Documents/Honours/WorkingDir"
-DATABASE_URL ="http://localhost:8000"  
\ No newline at end of file
+DATABASE_URL ="http://localhost:8000"  
+
+#memory budget (in MB) for the process wide model registry, least recently used models are freed past this
+MODEL_REGISTRY_BUDGET_MB = 4096
+
+#max crops per ensemble model call, and how many images have their crops verified together
+VERIFY_BATCH_SIZE = 32
+VERIFY_WINDOW = 4
+
+#size the ensemble letterboxes its input to, ONNX exports are made at the same size
+VERIFY_IMGSZ = 640
+
+#stop running ensemble models on a crop once its tree vote is decided
+CASCADE_VOTING = True
+
+#max images waiting between two stages of the annotation pipeline, bounds peak memory
+PIPELINE_QUEUE_DEPTH = 4
+
+#how many images are decoded ahead of SAM2, and how many threads decode them
+PREFETCH_DEPTH = 4
+PREFETCH_WORKERS = 2
+
+#how the verification ensemble runs: "auto", "torch" or "onnx" (ONNX Runtime on CPU)
+INFERENCE_BACKEND = "auto"
+
+#local cache of masks and ensemble scores per image, reused when a photo appears in another dataset
+ANNOTATION_CACHE_ENABLED = True
+ANNOTATION_CACHE_PATH = WORKING_DIR + "/cache/annotations.sqlite"
+
+#memory mapped store of SAM2 image embeddings, least recently used entries are evicted past the size budget
+EMBEDDING_CACHE_ENABLED = True
+EMBEDDING_CACHE_DIR = WORKING_DIR + "/cache/sam2_embeddings"
+EMBEDDING_CACHE_MAX_MB = 20480
+
+#per dataset journals of annotation progress, used to resume interrupted jobs
+JOURNAL_DIR = WORKING_DIR + "/journals"
+JOURNAL_FSYNC = True
+
+#annotation worker processes (1 runs in the calling thread), threads each may use (0 splits the cores evenly), images handed out per request
+ANNOTATION_WORKERS = 1
+THREADS_PER_WORKER = 0
+ANNOTATION_SHARD_SIZE = 16
+
+#where nodes annotating one shard of a dataset write their reports for the merge step
+SHARD_DIR = WORKING_DIR + "/shards"
+
+#photos per bulk annotation lookup, and concurrent requests when the DMS only has the per photo endpoint (at most DMS_CONCURRENCY)
+ANNOTATION_LOOKUP_BATCH = 500
+ANNOTATION_LOOKUP_WORKERS = 16
+
+#annotation uploads: annotations per request, seconds to wait for a batch to fill, retries and first retry delay in seconds
+UPLOAD_BATCH_SIZE = 64
+UPLOAD_MAX_WAIT = 0.5
+UPLOAD_RETRIES = 5
+UPLOAD_BACKOFF = 1.0
+
+#photos removed from a dataset per request
+REMOVAL_BATCH_SIZE = 200
+
+#DMS client: pooled connections, retries of requests safe to repeat, first retry delay in seconds,
+#(connect, read) timeout in seconds, and longer timeouts for endpoints that move whole datasets or models
+DMS_POOL_SIZE = 32
+DMS_RETRIES = 3
+DMS_BACKOFF = 0.5
+DMS_TIMEOUT = (5, 60)
+DMS_TIMEOUTS = {
+    "/dataset": (5, 1800),
+    "/dataset/photos": (5, 1800),
+    "/dataset/files": (5, 1800),
+    "/models/path": (5, 1800),
+    "/models/upload/chunk": (5, 300),
+}
+
+#max DMS requests the async client has in flight at once, its thread pool is this size
+DMS_CONCURRENCY = 32
+
+#seconds model and dataset listings are cached for, writes through db.py invalidate them early
+METADATA_CACHE_TTL = 300
+
+#model weight uploads: chunk size in MB, failed chunks are retried by the DMS client (DMS_RETRIES)
+MODEL_UPLOAD_CHUNK_MB = 8
@@ -1,57 +1,76 @@
 import os
 import sys
 import torch
-from ultralytics import YOLO
-import cv2
 import numpy as np
 from system import system_instance
+from config import VERIFY_WINDOW, PIPELINE_QUEUE_DEPTH, PREFETCH_DEPTH, PREFETCH_WORKERS, ANNOTATION_CACHE_ENABLED, EMBEDDING_CACHE_ENABLED
+from config import ANNOTATION_WORKERS, THREADS_PER_WORKER, UPLOAD_BATCH_SIZE, UPLOAD_MAX_WAIT, UPLOAD_RETRIES, UPLOAD_BACKOFF, REMOVAL_BATCH_SIZE
+from image_loader import ImagePrefetcher, load_image
+from pipeline import Pipeline
+from mask_codec import CompactMask, compact_masks
+from inference_backends import select_device
+from sam2_presets import SAM2_PRESETS, SAM2_SHARED_SETTINGS, DEFAULT_SAM2_PRESET
+from tree_verifier import is_tree_batch, score_crops, tree_vote, decided_vote, CascadeStats, TREE_MODEL_PATHS, VERIFY_IMGSZ
+from annotation_cache import AnnotationCache, settings_fingerprint, record_to_masks
+from file_utils import file_checksum
+from embedding_cache import EmbeddingCache, attach_embedding_cache
+from job_journal import JobJournal, photo_id_from_path
+from batch_sender import BatchSender
 import db 
 import time
 
 
   
+SAM2_MODEL_CFG = "sam2_hiera_b+"
+SAM2_CHECKPOINT = "checkpoints/sam2_hiera_base_plus.pt"
+
+# images are shrunk to this size before segmentation
+TARGET_SIZE = 1024
+
+# masks kept per image for verification
+MASK_MIN_AREA = 300
+MAX_MASKS = 15
 
 # SAM2 Model Setup
-def setup_sam2_model(model_cfg="sam2_hiera_b+",checkpoint="checkpoints/sam2_hiera_base_plus.pt"):
+def setup_sam2_model(model_cfg=SAM2_MODEL_CFG,checkpoint=SAM2_CHECKPOINT):
 
     from sam2.build_sam import build_sam2
-    device = "cuda" if torch.cuda.is_available() else "cpu"
+    device = select_device()
 
     # Build SAM2 model - use config name without .yaml extension
     sam2_model = build_sam2(model_cfg, checkpoint, device=device)
     
-    # Enable half precision for memory efficiency
-    sam2_model.half()
+    # Enable half precision for memory efficiency, most CPUs have no fast fp16 path so stay fp32 there
+    if device == "cuda":
+        sam2_model.half()
         
     return sam2_model
 
 # SAM2 Mask Generator 
-def create_sam2_mask_generator(sam2_model):
+def create_sam2_mask_generator(sam2_model, preset=DEFAULT_SAM2_PRESET):
     from sam2.automatic_mask_generator import SAM2AutomaticMaskGenerator
+    if preset not in SAM2_PRESETS:
+        raise Exception(f"Unknown SAM2 preset {preset}, expected one of {', '.join(SAM2_PRESETS)}")
+
     return SAM2AutomaticMaskGenerator(
         model=sam2_model,
-        points_per_side=32,
-        pred_iou_thresh=0.85,
-        stability_score_thresh=0.8,
-        crop_n_layers=0,  # Keep 0 for memory efficiency
-        crop_overlap_ratio=0.3,
-        min_mask_region_area=350,
-        points_per_batch=32,
-        crop_n_points_downscale_factor=2,
-        box_nms_thresh=0.7,
+        **SAM2_SHARED_SETTINGS,
+        **SAM2_PRESETS[preset],
     )
 
-# shrink image to make processing faster
-def preprocess_image(image_rgb, target_size=1024):
-    height, width = image_rgb.shape[:2]
-    
-    if max(height, width) > target_size:
-        scale = target_size / max(height, width)
-        new_width = int(width * scale)
-        new_height = int(height * scale)
-        image_rgb = cv2.resize(image_rgb, (new_width, new_height), interpolation=cv2.INTER_AREA)
-    
-    return image_rgb
+#fingerprint of every setting that changes the masks or ensemble scores an image gets, keys the annotation cache
+#vote thresholds are left out on purpose, annotations are re-derived from the stored scores when they change
+def annotation_fingerprint(preset=DEFAULT_SAM2_PRESET):
+    settings = {
+        "sam2_model_cfg": SAM2_MODEL_CFG,
+        "sam2_generator": dict(SAM2_SHARED_SETTINGS, **SAM2_PRESETS[preset]),
+        "target_size": TARGET_SIZE,
+        "mask_min_area": MASK_MIN_AREA,
+        "max_masks": MAX_MASKS,
+        "tree_models": TREE_MODEL_PATHS,
+        "verify_imgsz": VERIFY_IMGSZ,
+    }
+    return settings_fingerprint(settings, [SAM2_CHECKPOINT] + TREE_MODEL_PATHS)
 
 # decrease number of masks as unlikely to be that many trees thus resulting in less processing needed to determine if mask is a tree
 def filter_masks(masks, min_area=500, max_masks=10):
@@ -66,8 +85,11 @@ def convert_masks_to_yolo_annotations(masks, image_shape, class_id=0):
     yolo_annotations = []
 
     for mask in masks:
-        # Get bounding box (x_min, y_min, width, height)
-        x_min, y_min, width, height = mask['bbox']
+        # Get bounding box (x_min, y_min, width, height), from the compact mask if SAM2 did not supply one
+        if 'bbox' in mask:
+            x_min, y_min, width, height = mask['bbox']
+        else:
+            x_min, y_min, width, height = mask['segmentation'].bbox
         
         # Convert to YOLO format (normalized center x/y, width, height)
         x_center = (x_min + width / 2) / w_img #Optional: View model architecture/info
@@ -92,71 +114,77 @@ def save_annotations(annotation, image_path,classes):
 
 #determines if image contains a tree
 def is_tree(image):
-
-    ################# replace with api request once model deployment is complete ##########
-    model_paths = ["checkpoints/best_vX.pt","checkpoints/best_vM.pt","checkpoints/best_vL.pt","checkpoints/best_vS.pt"]
-    conf_thresh = 0.4
-    agreement_threshold = 0.25
-
-
-    votes = 0
-    total_models = len(model_paths)
-    
-    for model_path in model_paths:
-        model = YOLO(model_path)
-        model.eval()
-        model.to('cuda')
-        results = model(image, verbose=False)
-        
-        detected = False
-        for result in results:
-            boxes = result.boxes
-            for box in boxes:
-                cls = int(box.cls[0])
-                conf = float(box.conf[0])
-                class_name = model.names[cls]
-                
-                if class_name.lower() == "tree" and conf >= conf_thresh:
-                    detected = True
-                    break
-            if detected:
-                break
-        
-        if detected:
-            votes += 1
-        del model
-    
-    agreement_ratio = votes / total_models
-    
-    
-    return agreement_ratio >= agreement_threshold
-
+    return is_tree_batch([image])[0]
+
+
+# finds the window of the image a mask covers and the mask inside that window
+# dense masks are sliced to the SAM2 bbox when one is given rather than searched pixel by pixel
+def mask_window(image_shape, mask, bbox=None):
+    if isinstance(mask, CompactMask):
+        if mask.is_empty:
+            return None
+        return mask.window(), mask.crop()
+
+    if bbox is None:
+        return mask_window(image_shape, CompactMask.from_dense(mask))
+
+    # SAM2 boxes are (x_min, y_min, width, height) with inclusive max coordinates
+    x_min, y_min, width, height = (int(round(v)) for v in bbox)
+    window = (slice(max(y_min, 0), min(y_min + height + 1, image_shape[0])),
+              slice(max(x_min, 0), min(x_min + width + 1, image_shape[1])))
+    region = np.asarray(mask[window], dtype=bool)
+    if region.size == 0 or not region.any():
+        return None
+    return window, region
+
+# copies the masked pixels of a window into out, pixels outside the mask become black
+def write_masked_window(image, window, region, out=None):
+    crop_shape = region.shape + image.shape[2:]
+    if out is None:
+        out = np.empty(crop_shape, dtype=image.dtype)
+    elif out.shape != crop_shape:
+        raise ValueError(f"Output buffer has shape {out.shape}, expected {crop_shape}")
+
+    if image.ndim == 3:
+        region = region[..., None]
+    np.multiply(image[window], region, out=out)
+    return out
 
 #extracts only the masked region so that isTree is only looking at that region
+#only the bounding box window is read, the rest of the image is never touched
 # image: numpy array (H, W, C)
-# mask: binary mask (H, W) 
-def extract_masked_region(image, mask):
-
-
+# mask: CompactMask, or a binary mask (H, W)
+# bbox: optional SAM2 bbox, avoids searching a dense mask for its bounds
+# out: optional preallocated array of the crop shape to write into
+def extract_masked_region(image, mask, bbox=None, out=None):
 
-    # Ensure mask is boolean
-    mask = mask.astype(bool)
+    found = mask_window(image.shape, mask, bbox)
+    if found is None:
+        return None  # empty mask
+    window, region = found
 
-    # Apply mask
-    masked_image = np.zeros_like(image)
-    masked_image[mask] = image[mask]
+    return write_masked_window(image, window, region, out)
 
-    # Find bounding box of mask
-    ys, xs = np.where(mask)
-    if len(xs) == 0 or len(ys) == 0:
-        return None  # empty mask
-    x_min, x_max = xs.min(), xs.max()
-    y_min, y_max = ys.min(), ys.max()
+#extracts the masked region of every SAM2 mask of an image in one call
+#all crops are views into one buffer allocated for the image, empty masks give None
+def extract_masked_regions(image, masks):
+    found = [mask_window(image.shape, mask['segmentation'], mask.get('bbox')) for mask in masks]
 
-    # Crop to bounding box
-    cropped = masked_image[y_min:y_max+1, x_min:x_max+1]
+    channels = int(np.prod(image.shape[2:], dtype=np.int64))
+    buffer = np.empty(sum(region.size * channels for _, region in filter(None, found)), dtype=image.dtype)
 
-    return cropped
+    crops = []
+    offset = 0
+    for window_region in found:
+        if window_region is None:
+            crops.append(None)
+            continue
+        window, region = window_region
+        size = region.size * channels
+        out = buffer[offset:offset + size].reshape(region.shape + image.shape[2:])
+        offset += size
+        crops.append(write_masked_window(image, window, region, out))
+    return crops
 
 
 def download_dataset_photos(datset_id):
@@ -184,16 +212,15 @@ def get_image_paths(dataset_path):
 
     return all_paths
 
+#drops images that already have annotations for the given classes, looked up in bulk
 def filter_image_paths(image_paths,classes):
-    filtered_paths = []
-    for path in image_paths:
-        photo_id = os.path.basename(path).split(".")[0]
+    photo_ids = [os.path.basename(path).split(".")[0] for path in image_paths]
+    annotation_classes_by_photo = db.get_annotation_classes(photo_ids)
 
-        annotations = db.get_annotations(photo_id)
-    
+    filtered_paths = []
+    for path, photo_id in zip(image_paths, photo_ids):
         add_back = True
-        for annotation in annotations:
-            annotation_classes = annotation["classes"]
+        for annotation_classes in annotation_classes_by_photo[photo_id]:
             if set(annotation_classes) == set(classes):
                 add_back = False
                 break
@@ -203,117 +230,402 @@ def filter_image_paths(image_paths,classes):
 
 
 
-def annotate_dataset(dataset_id, progress_callback):
-    start = time.time()
-
+#fingerprint of the SAM2 image encoder, keys the embedding cache together with the image itself
+def embedding_fingerprint():
+    settings = {
+        "sam2_model_cfg": SAM2_MODEL_CFG,
+        "device": select_device(),
+        "target_size": TARGET_SIZE,
+    }
+    return settings_fingerprint(settings, [SAM2_CHECKPOINT])
+
+#loads a pipeline item, taking its masks and scores from the annotation cache when the image was processed before
+#images a resumed job already verified come straight from the journal with their annotations
+def load_pipeline_item(image_path, target_size=TARGET_SIZE, cache=None, fingerprint=None, journal=None):
+    item = {"image_path": image_path}
+
+    if journal is not None:
+        annotations = journal.pending_annotations(image_path)
+        if annotations is not None:
+            item["annotations"] = annotations
+            return item
+
+    if cache is not None:
+        item["content_hash"] = file_checksum(image_path)
+        record = cache.get(item["content_hash"], fingerprint)
+        if record is not None:
+            item["masks"] = record_to_masks(record)
+            item["image_shape"] = tuple(record["image_shape"])
+            item["cache_hit"] = True
+            return item
+
+    image_rgb = load_image(image_path, target_size)
+    if image_rgb is None:
+        return None
+    item["image_rgb"] = image_rgb
+    item["image_shape"] = image_rgb.shape[:2]
+    return item
+
+#runs SAM2 over a pipeline item and keeps its most promising masks
+def generate_masks(mask_generator, item, journal=None):
+    if "masks" in item or "annotations" in item:
+        return item  # cache hit or already verified
 
-    # put photos into WORKING_DIR
-    progress_callback("Downloading Photos",False)
-    dataset_path = db.load_dataset_photos(dataset_id)
+    torch.cuda.empty_cache()
 
-    classes = db.get_classes(dataset_id)
+    print(f"Processing (SAM2 mask gen) {item['image_path']}")
 
-    # Get image paths dict 
-    image_paths = get_image_paths(dataset_path)
+    # Generate masks with autocast for fp16 when on GPU
+    device = select_device()
+    with torch.amp.autocast(device_type=device, dtype=torch.float16, enabled=device == "cuda"):
+        masks = mask_generator.generate(item["image_rgb"])
 
+    # keep masks compact from here on, the full size segmentations are freed straight away
+    item["masks"] = compact_masks(filter_masks(masks, min_area=MASK_MIN_AREA, max_masks=MAX_MASKS))
+    if journal is not None:
+        journal.record(item["image_path"], "masks")
+    return item
 
+#checks which masks of a window of pipeline items contain trees and turns them into yolo annotations
+#ensemble scores are kept on each mask, masks restored from the cache only run the models that could still change their vote
+def verify_items(items, cascade_stats=None, cache=None, fingerprint=None, journal=None):
+    total_models = len(TREE_MODEL_PATHS)
 
-    #filter out images that already have annotations for given classes
-    image_paths = filter_image_paths(image_paths,classes)
-   
-
-    #  Setup SAM2 and generate masks for ALL images
-    sam2_model = setup_sam2_model()
-    mask_generator = create_sam2_mask_generator(sam2_model)
+    # crop every mask in the window so the ensemble sees them in as few batches as possible
+    pending = []
+    for item in items:
+        if "annotations" in item:
+            continue
+        to_score = [mask for mask in item["masks"] if decided_vote(mask.get("scores", {}), total_models) is None]
+        if not to_score:
+            continue
 
-    # Store all masks per image
-    all_masks = {}
+        image_rgb = item.get("image_rgb")
+        if image_rgb is None:
+            # cached scores cannot decide the vote under the current thresholds
+            image_rgb = load_image(item["image_path"], TARGET_SIZE)
+            if image_rgb is None:
+                continue
 
-    progress_callback("Generating Annotations", False)
+        item["rescored"] = True
+        for mask, cropped_image in zip(to_score, extract_masked_regions(image_rgb, to_score)):
+            if cropped_image is None or cropped_image.size == 0:
+                continue
+            pending.append((mask, cropped_image))
 
-    for  image_path in image_paths:
-        
+    if pending:
+        scores = score_crops([crop for _, crop in pending], stats=cascade_stats,
+                             initial_scores=[mask.get("scores", {}) for mask, _ in pending])
+        for (mask, _), mask_scores in zip(pending, scores):
+            mask["scores"] = mask_scores
         torch.cuda.empty_cache()
 
-        print(f"Processing (SAM2 mask gen) {image_path}")
-
-        # Load & preprocess image
-        image = cv2.imread(image_path)
-        if image is None:
-            print(f"Error: Could not load image {image_path}")
+    results = []
+    for item in items:
+        if "annotations" in item:
+            results.append(item)
             continue
 
-        image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        original_shape = image_rgb.shape[:2]
-        image_rgb = preprocess_image(image_rgb, target_size=1024)
-       
-
-        # Generate masks with autocast for fp16
-        with torch.amp.autocast(device_type='cuda', dtype=torch.float16):
-            masks = mask_generator.generate(image_rgb)
-
-
-        # Filter masks 
-        masks = filter_masks(masks, min_area=300, max_masks=15)
-    
+        # fresh images are always stored, even with no masks to score, so SAM2 never runs on them again
+        if cache is not None and "content_hash" in item and (not item.get("cache_hit") or item.get("rescored")):
+            cache.put(item["content_hash"], fingerprint, item["masks"], item["image_shape"])
+
+        tree_masks = [mask for mask in item["masks"] if tree_vote(mask.get("scores", {}), total_models=total_models)]
+        annotations = convert_masks_to_yolo_annotations(tree_masks, item["image_shape"])
+
+        if journal is not None:
+            journal.record(item["image_path"], "verified", annotations)
+
+        # only the annotations travel further, the image and masks are freed here
+        results.append({"image_path": item["image_path"], "annotations": annotations})
+    return results
+
+#background uploader that sends annotations to the DMS in batches
+#an image is journaled as uploaded only once its annotation reached the DMS
+#batches are only retried when the DMS dedupes them or they never reached it, see db.upload_annotations_batch
+def create_annotation_uploader(journal=None):
+    def send(entries):
+        db.upload_annotations_batch(entries)
+
+    def uploaded(entry):
+        if journal is not None:
+            journal.record(entry["image_path"], "uploaded")
+
+    return BatchSender(send, batch_size=UPLOAD_BATCH_SIZE, max_wait=UPLOAD_MAX_WAIT, retries=UPLOAD_RETRIES,
+                       backoff=UPLOAD_BACKOFF, retry_on=db.TRANSIENT_ERRORS, on_sent=uploaded, name="annotation uploader")
+
+#background remover that takes photos out of the dataset in batches
+#on_removed: called with each entry once its batch reached the DMS
+def create_photo_remover(dataset_id, on_removed=None):
+    def send(entries):
+        try:
+            db.remove_photos_from_dataset(dataset_id, [entry["photo_id"] for entry in entries])
+        except db.PartialBatchError as e:
+            # hand the sender back its own entries for the photos still to remove
+            remaining = set(e.remaining)
+            e.remaining = [entry for entry in entries if entry["photo_id"] in remaining]
+            raise
+
+    return BatchSender(send, batch_size=REMOVAL_BATCH_SIZE, max_wait=UPLOAD_MAX_WAIT, retries=UPLOAD_RETRIES,
+                       backoff=UPLOAD_BACKOFF, retry_on=db.TRANSIENT_ERRORS, on_sent=on_removed, name="photo remover")
+
+#deletes local copies of photos
+def delete_files(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+#background remover of local copies, a photo is journaled as removed once its copy is gone
+#entries without an image path have no local copy left, they are only journaled
+def create_file_remover(journal=None):
+    def send(entries):
+        delete_files([entry["image_path"] for entry in entries if entry["image_path"] is not None])
+
+    def removed(entry):
+        if journal is not None:
+            journal.record(entry["photo_id"], "removed")
+
+    return BatchSender(send, batch_size=REMOVAL_BATCH_SIZE, max_wait=UPLOAD_MAX_WAIT, on_sent=removed, name="file remover")
+
+#the background senders annotate_dataset hands its results to
+#a photo is removed from the DMS first and its local copy deleted once that succeeded, only then is it journaled as removed
+#remove_from_dataset False only deletes local copies, the DMS removal is left to the shard merge step
+class ResultSenders:
+    def __init__(self, dataset_id, journal=None, remove_from_dataset=True):
+        self.journal = journal
+        self.uploader = create_annotation_uploader(journal)
+        self.file_remover = create_file_remover(journal)
+        self.photo_remover = create_photo_remover(dataset_id, self.file_remover.submit) if remove_from_dataset else None
+
+    def upload(self, image_path, classes, annotations):
+        self.uploader.submit({
+            "photo_id": os.path.splitext(os.path.basename(image_path))[0],
+            "classes": classes,
+            "annotation": annotations,
+            "image_path": image_path,
+        })
+
+    #queues a photo for removal, the removal is journaled first so an interrupted job can finish it
+    def remove(self, image_path):
+        if self.journal is not None:
+            self.journal.record(image_path, "removing")
+        self._queue_removal(photo_id_from_path(image_path), image_path)
+
+    #queues a removal an interrupted job had journaled but not finished
+    #image_path: the local copy of the photo, None if there is none left to delete
+    def resume_removal(self, photo_id, image_path):
+        self._queue_removal(photo_id, image_path)
+
+    #without a photo remover the removal is left to the shard merge step, which reads it from the journal
+    def _queue_removal(self, photo_id, image_path):
+        entry = {"photo_id": photo_id, "image_path": image_path}
+        if self.photo_remover is None:
+            self.file_remover.submit(entry)
+        else:
+            self.photo_remover.submit(entry)
+
+    # the photo remover hands its removals on to the file remover, so it has to be flushed first
+    def senders(self):
+        return [sender for sender in (self.uploader, self.photo_remover, self.file_remover) if sender is not None]
+
+    #waits until everything queued reached the DMS and disk, then stops the senders
+    def close(self):
+        for sender in self.senders():
+            sender.close()
+
+    #stops the senders, anything not sent yet is left for the journal to pick up on resume
+    def stop(self):
+        for sender in self.senders():
+            sender.stop()
+
+#uploads the annotations of a pipeline item, or removes the photo if no trees were found
+#with senders the work is queued for them instead of done straight away
+#with remove_from_dataset False only the local copy is deleted, the DMS removal is left to the shard merge step
+def store_result(item, dataset_id, classes, journal=None, remove_from_dataset=True, senders=None):
+    image_path = item["image_path"]
+    annotations = item["annotations"]
+
+    if annotations and senders is not None:
+        senders.upload(image_path, classes, annotations)
+        print(f"Queued annotations for {image_path}")
+        return item
+    elif annotations:
+        save_annotations(annotations, image_path, classes)
+        print(f"Saved annotations for {image_path}")
+        stage = "uploaded"
+    elif senders is not None:
+        print(f"No tree annotations found for {image_path}")
+        senders.remove(image_path)
+        return item
+    else:
+        print(f"No tree annotations found for {image_path}")
+        os.remove(image_path)
+        if remove_from_dataset:
+            photo_id = image_path.split("/")[-1].split(".")[0]
+            db.remove_photo_from_dataset(dataset_id,photo_id)
+        stage = "removed"
+
+    if journal is not None:
+        journal.record(image_path, stage)
+    return item
+
+
+#holds SAM2, the caches and the counters a process uses to annotate images
+#SAM2 stays loaded alongside the verification ensemble for as long as the context is open
+class AnnotationContext:
+    def __init__(self, preset=DEFAULT_SAM2_PRESET, use_cache=ANNOTATION_CACHE_ENABLED, use_embedding_cache=EMBEDDING_CACHE_ENABLED):
+        self.preset = preset
+        self.sam2_model = setup_sam2_model()
+        self.mask_generator = create_sam2_mask_generator(self.sam2_model, preset)
+
+        self.embedding_cache = None
+        if use_embedding_cache:
+            self.embedding_cache = EmbeddingCache()
+            attach_embedding_cache(self.mask_generator, self.embedding_cache, embedding_fingerprint())
+
+        self.cache = AnnotationCache() if use_cache else None
+        self.fingerprint = annotation_fingerprint(preset)
+        self.cascade_stats = CascadeStats()
+
+        # Load YOLOv5 model ONCE ---  want to get rid of this in the future
+        yolov5_path = '/home/dj66/Documents/Honours/IPS-Image-processing-system-/IPS/yolov5'
+        if yolov5_path not in sys.path:
+            sys.path.insert(0, yolov5_path)
+
+    #counters of the work done, plain numbers so they can be sent between processes
+    def stats(self):
+        stats = dict(self.cascade_stats.as_dict())
+        if self.cache is not None:
+            stats["cache_hits"] = self.cache.hits
+            stats["cache_misses"] = self.cache.misses
+        if self.embedding_cache is not None:
+            stats["embedding_hits"] = self.embedding_cache.hits
+            stats["embedding_misses"] = self.embedding_cache.misses
+        return stats
+
+    # Clear models & free memory
+    def close(self):
+        if self.cache is not None:
+            self.cache.close()
+        del self.sam2_model
+        del self.mask_generator
+        torch.cuda.empty_cache()
 
-        # Save masks info for later
-        all_masks[image_path] = {
-            "masks": masks,
-            "image_rgb": image_rgb  # store preprocessed RGB for later use
-        }
 
-    # Clear SAM2 model & free memory
-    del sam2_model
-    del mask_generator
-    torch.cuda.empty_cache()
+#runs images through decoding, mask generation and verification, handing each verified item to on_result
+#every stage overlaps, with at most queue_depth images waiting between any two stages
+def annotate_images(context, image_paths, on_result, journal=None, queue_depth=PIPELINE_QUEUE_DEPTH,
+                    prefetch_depth=PREFETCH_DEPTH, prefetch_workers=PREFETCH_WORKERS):
+
+    def load_item(image_path, target_size):
+        return load_pipeline_item(image_path, target_size, context.cache, context.fingerprint, journal)
+
+    prefetcher = ImagePrefetcher(image_paths, depth=prefetch_depth, workers=prefetch_workers, target_size=TARGET_SIZE, loader=load_item)
+    pipeline = Pipeline((item for _, item in prefetcher), depth=queue_depth)
+    pipeline.add_stage("masks", lambda item: generate_masks(context.mask_generator, item, journal))
+    pipeline.add_stage("verify", lambda items: verify_items(items, context.cascade_stats, context.cache, context.fingerprint, journal),
+                       batch_size=VERIFY_WINDOW)
+    pipeline.add_stage("result", on_result)
+    pipeline.run()
+
+#shows the counters of a finished job to the user
+def report_stats(stats, progress_callback):
+    cascade_stats = CascadeStats()
+    cascade_stats.add(stats)
+    print(cascade_stats.summary())
+    progress_callback(cascade_stats.summary(), False)
+    if "cache_hits" in stats:
+        progress_callback(f"Annotation cache: {stats['cache_hits']} hits, {stats['cache_misses']} misses", False)
+    if "embedding_hits" in stats:
+        progress_callback(f"SAM2 embedding cache: {stats['embedding_hits']} hits, {stats['embedding_misses']} misses", False)
+
+
+#annotates every photo of a dataset, progress is journaled so a job that stops part way resumes where it left off
+#when called again for the same dataset
+#with workers > 1 images are annotated by a pool of processes, each loading the models once
+#shard: (index, count) to annotate only the photos of one shard, see shard_annotater.py
+def annotate_dataset(dataset_id, progress_callback, preset=DEFAULT_SAM2_PRESET, queue_depth=PIPELINE_QUEUE_DEPTH,
+                     prefetch_depth=PREFETCH_DEPTH, prefetch_workers=PREFETCH_WORKERS, use_cache=ANNOTATION_CACHE_ENABLED,
+                     use_embedding_cache=EMBEDDING_CACHE_ENABLED, workers=ANNOTATION_WORKERS, threads_per_worker=THREADS_PER_WORKER,
+                     shard=None):
+    start = time.time()
 
-    # Load YOLOv5 model ONCE ---  want to get rid of this in the future
-    yolov5_path = '/home/dj66/Documents/Honours/IPS-Image-processing-system-/IPS/yolov5'
-    if yolov5_path not in sys.path:
-        sys.path.insert(0, yolov5_path)
 
- 
+    # put photos into WORKING_DIR
+    progress_callback("Downloading Photos",False)
+    dataset_path = db.load_dataset_photos(dataset_id)
 
-    # --- PART 3: For each image and its masks, check tree presence and save annotations ---
-    progress_callback("Filtering Annotations", False)
-    for image_path, data in all_masks.items():
-        image_rgb = data["image_rgb"]
-        masks = data["masks"]
+    classes = db.get_classes(dataset_id)
 
-        tree_masks = []
+    # Get image paths dict 
+    image_paths = get_image_paths(dataset_path)
+    paths_by_id = {photo_id_from_path(path): path for path in image_paths}
+
+    if shard is not None:
+        from shard_annotater import select_shard, shard_name
+        image_paths = select_shard(image_paths, *shard)
+        progress_callback(f"Shard {shard[0]}/{shard[1]}: {len(image_paths)} photos", False)
+
+    # skip images a previous run of this job already finished
+    journal = JobJournal(dataset_id, name=shard_name(dataset_id, *shard) if shard is not None else None)
+    if not journal.complete and journal.settings:
+        preset = journal.settings.get("preset", preset)
+        progress_callback(f"Resuming Annotation: {journal.counts()}", False)
+    journal.start({"preset": preset})
+    removing = journal.photo_ids("removing")
+    image_paths = [path for path in image_paths if not journal.is_done(path) and journal.stage(path) != "removing"]
 
+    #filter out images that already have annotations for given classes
+    image_paths = filter_image_paths(image_paths,classes)
    
+    progress_callback("Generating Annotations", False)
 
-        for mask in masks:
-            cropped_image = extract_masked_region(image_rgb, mask['segmentation'])
-            if cropped_image is None or cropped_image.size == 0:
-                continue
+    senders = ResultSenders(dataset_id, journal, remove_from_dataset=shard is None)
 
-            # Check if mask region contains a tree
-            if is_tree(cropped_image):
-                tree_masks.append(mask)
-                torch.cuda.empty_cache()
+    def upload(item):
+        return store_result(item, dataset_id, classes, journal, remove_from_dataset=shard is None, senders=senders)
 
-        annotations = convert_masks_to_yolo_annotations(tree_masks, image_rgb.shape)
+    try:
+        # finish removals an interrupted run had queued
+        for photo_id in removing:
+            senders.resume_removal(photo_id, paths_by_id.get(photo_id))
 
-        if annotations:
-            save_annotations(annotations, image_path, classes)
-            print(f"Saved annotations for {image_path}")
+        if workers > 1:
+            from parallel_annotater import annotate_in_processes
+            stats = annotate_in_processes(image_paths, upload, journal, preset, workers, threads_per_worker,
+                                          use_cache=use_cache, use_embedding_cache=use_embedding_cache)
         else:
-            print(f"No tree annotations found for {image_path}")
-            os.remove(image_path)
-            photo_id = image_path.split("/")[-1].split(".")[0]
-            db.remove_photo_from_dataset(dataset_id,photo_id)
-
-    # Clean up YOLOv5 model & memory
-    torch.cuda.empty_cache()
+            context = AnnotationContext(preset, use_cache, use_embedding_cache)
+            try:
+                annotate_images(context, image_paths, upload, journal, queue_depth, prefetch_depth, prefetch_workers)
+            finally:
+                context.close()
+            stats = context.stats()
+
+        # every annotation and removal has to be on the DMS before the job counts as complete
+        senders.close()
+        journal.mark_complete()
+    finally:
+        senders.stop()
+        journal.close()
+
+    progress_callback(f"Uploaded {senders.uploader.sent} annotations in {senders.uploader.batches} requests", False)
+    if senders.photo_remover is not None:
+        progress_callback(f"Removed {senders.photo_remover.sent} photos in {senders.photo_remover.batches} requests", False)
+
+    report_stats(stats, progress_callback)
 
     end = time.time()
     print(f"Elapsed time: {end - start:.4f} seconds")
-    # Notify system of dataset update
-    system_instance.change_dataset(dataset_id)
-
 
+    if shard is not None:
+        # the merge step finishes the dataset once every shard has reported
+        from shard_annotater import write_shard_report
+        write_shard_report(dataset_id, shard, journal, stats, end - start)
+        return stats
 
- 
+    # Notify system of dataset update
+    system_instance.change_dataset(dataset_id)
+    return stats
@@ -0,0 +1,143 @@
+import json
+import os
+import threading
+from config import WORKING_DIR
+from file_utils import file_checksum, write_json_atomic
+
+#this file keeps a manifest of the dataset materialized in WORKING_DIR: its id, version and the size, modification time
+#and checksum of every file
+#loading a dataset that is already present and unchanged does nothing, a changed one only fetches the files that differ
+#whether files were touched is decided from size and modification time, checksums are only computed to diff against the DMS
+
+
+MANIFEST_NAME = "dataset_manifest.json"
+
+# parts of WORKING_DIR that belong to the dataset, everything else there (caches, journals, runs) is left alone
+DATASET_ENTRIES = ("data.yaml", "images", "labels")
+
+# files written into the dataset folders that are not part of the dataset, such as the labels/*.cache ultralytics keeps
+IGNORED_SUFFIXES = (".cache",)
+
+# fetching more than this share of the files is done as one full load
+FULL_LOAD_RATIO = 0.5
+
+# datasets loaded by this process, a dataset with no DMS manifest is only loaded once per process
+_loaded_here = set()
+_lock = threading.Lock()
+
+
+def manifest_path(root=WORKING_DIR):
+    return os.path.join(root, MANIFEST_NAME)
+
+def read_manifest(root=WORKING_DIR):
+    try:
+        with open(manifest_path(root), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_manifest(manifest, root=WORKING_DIR):
+    write_json_atomic(manifest_path(root), manifest)
+
+#size and modification time of every dataset file under root as {relative path: {"size", "mtime"}}, IGNORED_SUFFIXES left out
+def stat_files(root=WORKING_DIR):
+    files = {}
+    for entry in DATASET_ENTRIES:
+        entry_path = os.path.join(root, entry)
+        if os.path.isfile(entry_path):
+            paths = [entry_path]
+        else:
+            paths = [os.path.join(folder, name) for folder, _, names in os.walk(entry_path) for name in names
+                     if not name.endswith(IGNORED_SUFFIXES)]
+
+        for path in paths:
+            relative = os.path.relpath(path, root).replace(os.sep, "/")
+            stat = os.stat(path)
+            files[relative] = {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+    return files
+
+#true if no dataset file was added, removed or written since the manifest files were recorded
+def untouched(stats, files):
+    return stats == {path: {"size": f["size"], "mtime": f["mtime"]} for path, f in files.items()}
+
+#checksums of every dataset file under root as {relative path: {"sha256", "size", "mtime"}}
+#files whose size and modification time match previous reuse its checksum
+def scan_files(root=WORKING_DIR, previous=None, stats=None):
+    previous = previous or {}
+    stats = stats if stats is not None else stat_files(root)
+    files = {}
+    for relative, stat in stats.items():
+        known = previous.get(relative)
+        if known is not None and known.get("sha256") and known["size"] == stat["size"] and known["mtime"] == stat["mtime"]:
+            files[relative] = known
+        else:
+            files[relative] = dict(stat, sha256=file_checksum(os.path.join(root, relative)))
+    return files
+
+#paths whose local checksum differs from the wanted one or that are missing, and local paths not wanted at all
+def diff_files(local, wanted):
+    changed = sorted(path for path, checksum in wanted.items() if local.get(path, {}).get("sha256") != checksum)
+    extra = sorted(path for path in local if path not in wanted)
+    return changed, extra
+
+
+#makes WORKING_DIR hold the dataset, doing as little as the manifest allows
+#returns "unchanged", "delta" or "full" depending on what had to be fetched
+#files are only hashed to diff against a DMS manifest, and only those changed since the last load
+def materialize_dataset(dataset_id, root=WORKING_DIR):
+    import db
+
+    with _lock:
+        manifest = read_manifest(root)
+        same_dataset = manifest is not None and manifest.get("dataset_id") == dataset_id
+        previous = manifest["files"] if same_dataset else {}
+        stats = stat_files(root)
+        unmodified = same_dataset and untouched(stats, previous)
+        remote = db.get_dataset_manifest(dataset_id)
+        version = remote.get("version") if remote is not None else None
+
+        if remote is None:
+            # the DMS cannot say what changed, trust an untouched copy this process loaded itself
+            if unmodified and dataset_id in _loaded_here:
+                return _loaded(dataset_id, "unchanged")
+            db.load_dataset(dataset_id)
+            mode = "full"
+            checksums = {}
+        elif unmodified and version is not None and version == manifest.get("version"):
+            # the DMS has not changed the dataset since this copy was loaded and nothing here touched it
+            return _loaded(dataset_id, "unchanged")
+        else:
+            local = scan_files(root, previous, stats)
+            checksums = remote["files"]
+            changed, extra = diff_files(local, checksums)
+            if not changed and not extra:
+                mode = "unchanged"
+            elif len(changed) > FULL_LOAD_RATIO * max(len(checksums), 1) or not db.load_dataset_files(dataset_id, changed):
+                db.load_dataset(dataset_id)
+                mode = "full"
+            else:
+                for path in extra:
+                    os.remove(os.path.join(root, path))
+                mode = "delta"
+
+        if mode == "unchanged":
+            files = local
+        else:
+            # the DMS just wrote the files, their checksums are the ones it sent rather than read back from disk
+            files = {path: dict(stat, sha256=checksums.get(path)) for path, stat in stat_files(root).items()}
+        write_manifest({"dataset_id": dataset_id, "version": version, "files": files}, root)
+        return _loaded(dataset_id, mode)
+
+# must hold _lock
+def _loaded(dataset_id, mode):
+    _loaded_here.add(dataset_id)
+    print(f"Dataset {dataset_id}: {mode}")
+    return mode
+
+#forgets that datasets were loaded, the next load checks with the DMS again
+def forget_loaded(dataset_id=None):
+    with _lock:
+        if dataset_id is None:
+            _loaded_here.clear()
+        else:
+            _loaded_here.discard(dataset_id)
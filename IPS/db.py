@@ -1,14 +1,79 @@
+import hashlib
+import json
 import requests
-from config import DATABASE_URL, WORKING_DIR
+from urllib3.exceptions import NewConnectionError
+from config import WORKING_DIR, ANNOTATION_LOOKUP_BATCH, ANNOTATION_LOOKUP_WORKERS
+from config import MODEL_UPLOAD_CHUNK_MB
+from dms_client import dms_client
+from ttl_cache import ttl_cached, invalidate, cache_stats
+from dataset_manifest import forget_loaded
+from file_utils import file_checksum, write_json_atomic
 import os 
 
 
+#raised when the DMS failed in a way that is worth retrying
+class TransientDMSError(Exception):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+# errors a retried request may succeed after
+TRANSIENT_ERRORS = (requests.ConnectionError, requests.Timeout, TransientDMSError)
+
+#raises TransientDMSError if the DMS is overloaded or had a server error
+def check_transient(response):
+    if response.status_code == 429 or response.status_code >= 500:
+        raise TransientDMSError(f"DMS returned status code {response.status_code}", response.status_code)
+
+#true if a request certainly never reached the DMS, so it can be sent again even where the DMS would not notice the repeat
+def not_received(error):
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    # a refused connection is a ConnectionError wrapping urllib3's NewConnectionError, directly or as the MaxRetryError reason
+    if isinstance(error, requests.ConnectionError) and error.args:
+        reason = getattr(error.args[0], "reason", error.args[0])
+        return isinstance(reason, NewConnectionError)
+    return isinstance(error, TransientDMSError) and error.status_code == 429
+
+#raised when only some entries of a batch reached the DMS, remaining holds the entries still to be sent
+#the entries that reached the DMS must not be sent again
+class PartialBatchError(Exception):
+    def __init__(self, message, remaining):
+        super().__init__(message)
+        self.remaining = remaining
+
+#a PartialBatchError where every remaining entry is worth retrying
+class TransientPartialBatchError(PartialBatchError, TransientDMSError):
+    pass
+
+#raises for the entries of a per entry fallback that failed, errors holds the error of each entry or None
+#retryable: tells whether an entry that failed with an error may be sent again
+def raise_failed(entries, errors, what, retryable):
+    failed = [(entry, error) for entry, error in zip(entries, errors) if error is not None]
+    if not failed:
+        return
+    remaining = [entry for entry, _ in failed]
+    message = f"{len(failed)} of {len(entries)} {what} failed: {failed[0][1]}"
+    if all(retryable(error) for _, error in failed):
+        raise TransientPartialBatchError(message, remaining) from failed[0][1]
+    raise PartialBatchError(message, remaining) from failed[0][1]
+
+
+
+#request counts and connection reuse of the DMS client
+def pool_stats():
+    return dms_client.stats()
+
+#hits and misses of the cached dataset and model lookups
+def metadata_cache_stats():
+    return cache_stats()
+
 
 ######################## Datset Interactions ########################
 #confirms with the database that the name provided is free to take
 def validate_dataset_name(name):
     params = {"name" : name}
-    response = requests.get(DATABASE_URL+"/dataset/name",params = params)
+    response = dms_client.get("/dataset/name",params = params)
     data = response.json()
 
     if response.status_code == 200:
@@ -24,9 +89,10 @@ def create_dataset(name,filters,split,classes):
     
     params = {"split": split, "name": name,"classes":classes}
 
-    response = requests.post(DATABASE_URL + "/dataset/photos", params = params, json = filters)
+    response = dms_client.post("/dataset/photos", params = params, json = filters)
 
     if response.status_code == 200:
+        invalidate("datasets")
         data = response.json()
         return data.get("id")
     else:
@@ -48,7 +114,7 @@ def load_dataset_photos(dataset_id):
     """
     
     params = {"dataset_id": dataset_id}
-    response = requests.get(DATABASE_URL + "/dataset/photos", params = params, stream=True)
+    response = dms_client.get("/dataset/photos", params = params, stream=True)
 
     if response.status_code == 200:
         data = response.json()
@@ -61,10 +127,11 @@ def load_dataset_photos(dataset_id):
 
 
 #retrieves dataset Id that belongs to name provided
+@ttl_cached("datasets")
 def get_dataset_id(dataset_name):
     params = {"name" : dataset_name }
 
-    response = requests.get(DATABASE_URL+"/dataset/id", params=params)
+    response = dms_client.get("/dataset/id", params=params)
     
     if response.status_code == 200:
         data = response.json()
@@ -75,9 +142,10 @@ def get_dataset_id(dataset_name):
 
 
 #retrieves all dataset names in alphabetical order
+@ttl_cached("datasets")
 def get_all_dataset_names():
     
-    response = requests.get(DATABASE_URL + "/datasets/names")
+    response = dms_client.get("/datasets/names")
     
     if response.status_code == 200:
         data = response.json()
@@ -86,10 +154,41 @@ def get_all_dataset_names():
         raise Exception("Error Retrieving Dataset Names from Database")   
 
 
+#gets the version and the sha256 of every file of a dataset as {"version": ..., "files": {path: sha256}}
+#returns None if the DMS has no manifest endpoint
+def get_dataset_manifest(dataset_id):
+    params = {"dataset_id" : dataset_id}
+    response = dms_client.get("/dataset/manifest", params = params)
+
+    if response.status_code in (404, 405):
+        return None
+    if response.status_code == 200:
+        return response.json()
+    else:
+        print(f"Failed to get dataset manifest. Status code: {response.status_code}")
+        raise Exception("Error Getting Dataset Manifest")
+
+#lets the server know to write only some files of a dataset into WORKING_DIR
+#param: paths: file paths relative to WORKING_DIR
+#returns False if the DMS cannot load single files
+def load_dataset_files(dataset_id, paths):
+    data = {"dataset_id": dataset_id, "paths": list(paths)}
+    response = dms_client.post("/dataset/files", json = data, idempotent=True)
+
+    if response.status_code in (404, 405):
+        return False
+    if response.status_code == 200:
+        return True
+    else:
+        print(f"Failed to download. Status code: {response.status_code}")
+        raise Exception("Error Downloading Dataset Files")
+
 #lets the server know to load dataset into WORKING_DIR
 def load_dataset(dataset_id):
     params = {"dataset_id" : dataset_id}
-    response = requests.get(DATABASE_URL + "/dataset", params = params, stream=True)
+    response = dms_client.get("/dataset", params = params, stream=True)
+    # the body is not needed, closing hands the connection back to the pool
+    response.close()
 
     if response.status_code == 200:
         return
@@ -98,9 +197,10 @@ def load_dataset(dataset_id):
         print(f"Failed to download. Status code: {response.status_code}")
         raise Exception("Error Downloading Dataset")
 
+@ttl_cached("datasets")
 def get_classes(dataset_id):
     params = {"dataset_id" : dataset_id}
-    response = requests.get(DATABASE_URL + "/dataset/metadata", params = params,)
+    response = dms_client.get("/dataset/metadata", params = params,)
 
     if response.status_code == 200:
         data = response.json()
@@ -110,23 +210,62 @@ def get_classes(dataset_id):
         print(f"Failed to get dataset classes. Status code: {response.status_code}")
         raise Exception("Error Getting Dataset Classes")
 
-def remove_photo_from_dataset(dataset_id,photo_id):
+#param: missing_ok: a photo that is not in the dataset counts as removed, e.g. when a removal whose reply was lost is sent again
+def remove_photo_from_dataset(dataset_id,photo_id,missing_ok=False):
     params = {
                 "dataset_id": dataset_id,
                 "photo_id" : photo_id
     }
-    response = requests.delete(DATABASE_URL + "/dataset/photo", params = params)
+    response = dms_client.delete("/dataset/photo", params = params)
+    check_transient(response)
 
-    if response.status_code == 200:
+    if response.status_code == 200 or (missing_ok and response.status_code == 404):
+        invalidate("datasets")
+        forget_loaded(dataset_id)
         return
 
     else:
         print(f"Failed to remove photo from dataset: Status code: {response.status_code}")
         raise Exception("Error Deleting Photo")
 
+# None until the first bulk removal tells whether the DMS has the bulk endpoint
+_bulk_removal_supported = None
+
+#removes many photos from a dataset in one request
+#DMS versions without the bulk endpoint are sent one removal per photo, concurrently,
+#if some fail PartialBatchError names them so only those are sent again
+def remove_photos_from_dataset(dataset_id,photo_ids):
+    global _bulk_removal_supported
+
+    if _bulk_removal_supported is not False:
+        data = {"dataset_id": dataset_id, "photo_ids": list(photo_ids)}
+        response = dms_client.delete("/dataset/photos", json = data)
+        if response.status_code in (404, 405):
+            print("DMS has no bulk photo removal, removing per photo")
+            _bulk_removal_supported = False
+        else:
+            check_transient(response)
+            if response.status_code != 200:
+                print(f"Failed to remove photos from dataset: Status code: {response.status_code}")
+                raise Exception("Error Deleting Photos")
+            _bulk_removal_supported = True
+            invalidate("datasets")
+            forget_loaded(dataset_id)
+            return
+
+    import async_db
+    photo_ids = list(photo_ids)
+    errors = async_db.remove_photos_many(dataset_id, photo_ids, return_exceptions=True)
+    raise_failed(photo_ids, errors, "photo removals", lambda error: isinstance(error, TRANSIENT_ERRORS))
+
 
 ######################## Annotation Interactions ########################
 
+#key the DMS dedupes annotation uploads on, a photo has one annotation per set of classes
+def annotation_key(photo_id, classes):
+    classes = [classes] if isinstance(classes, str) else sorted(classes)
+    return hashlib.sha1(json.dumps([str(photo_id), classes]).encode()).hexdigest()
+
 #uploads annotations to DMS
 #param: photo_id: id of photo being annotated for
 #param: classes: list of classes being annotated for 
@@ -139,16 +278,54 @@ def upload_annotations(photo_id,classes,annotation):
                 "classes" : classes,
                 "annotation" : annotation
             }
-    response = requests.post(DATABASE_URL+"/annotations", json=data)
+    # sent as a header so DMS versions that do not dedupe ignore it, callers must not rely on the DMS using it
+    headers = {"Idempotency-Key": annotation_key(photo_id, classes)}
+    response = dms_client.post("/annotations", json=data, headers=headers)
     
-
+    check_transient(response)
     if response.status_code != 200:
         raise Exception("An error occoured uploading annoatations")
 
+# None until the first batch upload tells whether the DMS has the batch endpoint
+_batch_upload_supported = None
+
+#uploads many annotations in one request
+#param: annotations: list of dicts with photo_id, classes and annotation, other keys are not sent
+#every entry carries an idempotency key the batch endpoint dedupes on, so a batch that may have been stored is safe to send again
+#DMS versions without the batch endpoint are sent one annotation per request, concurrently. Those requests are not deduped,
+#so if some fail PartialBatchError names them, and it is only worth retrying if none of them reached the DMS
+def upload_annotations_batch(annotations):
+    global _batch_upload_supported
+
+    if _batch_upload_supported is not False:
+        entries = [
+            {
+                "photo_id": entry["photo_id"],
+                "classes": entry["classes"],
+                "annotation": entry["annotation"],
+                "idempotency_key": annotation_key(entry["photo_id"], entry["classes"]),
+            }
+            for entry in annotations
+        ]
+        response = dms_client.post("/annotations/batch", json={"annotations": entries}, idempotent=True)
+        if response.status_code in (404, 405):
+            print("DMS has no batch annotation upload, uploading per photo")
+            _batch_upload_supported = False
+        else:
+            check_transient(response)
+            if response.status_code != 200:
+                raise Exception("An error occoured uploading annoatations")
+            _batch_upload_supported = True
+            return
+
+    import async_db
+    errors = async_db.upload_annotations_many(annotations, return_exceptions=True)
+    raise_failed(annotations, errors, "annotation uploads", not_received)
+
 #gets a annotation for a given photo
 def get_annotations(photo_id):
     params = {"photo_id" : photo_id}
-    response = requests.get(DATABASE_URL + "/annotations/photo", params = params)
+    response = dms_client.get("/annotations/photo", params = params)
 
     if response.status_code == 200:
         data = response.json()
@@ -157,14 +334,54 @@ def get_annotations(photo_id):
     else:
         print(f"Failed to get Annotations for photo {photo_id}. Status code: {response.status_code}")
         raise Exception("Error Retriving Annotations")
+
+# None until the first bulk lookup tells whether the DMS has the bulk endpoint
+_bulk_classes_supported = None
+
+#gets the classes of every annotation of many photos, batch_size photos per request
+#DMS versions without the bulk endpoint are asked per photo, workers requests at a time
+#returns: dict of photo_id -> list of class lists, one per annotation
+def get_annotation_classes(photo_ids, batch_size=ANNOTATION_LOOKUP_BATCH, workers=ANNOTATION_LOOKUP_WORKERS):
+    global _bulk_classes_supported
+
+    photo_ids = list(photo_ids)
+    results = {}
+
+    for start in range(0, len(photo_ids), batch_size):
+        if _bulk_classes_supported is False:
+            break
+        batch = photo_ids[start:start + batch_size]
+        response = dms_client.post("/annotations/classes", json={"photo_ids": batch}, idempotent=True)
+
+        if response.status_code in (404, 405):
+            print("DMS has no bulk annotation lookup, asking per photo")
+            _bulk_classes_supported = False
+            break
+        if response.status_code != 200:
+            print(f"Failed to get Annotation classes. Status code: {response.status_code}")
+            raise Exception("Error Retriving Annotations")
+
+        _bulk_classes_supported = True
+        classes = response.json()["classes"]
+        for photo_id in batch:
+            results[photo_id] = classes.get(photo_id, [])
+
+    remaining = [photo_id for photo_id in photo_ids if photo_id not in results]
+    if remaining:
+        import async_db
+        annotations = async_db.get_annotations_many(remaining, limit=workers)
+        for photo_id in remaining:
+            results[photo_id] = [annotation["classes"] for annotation in annotations[photo_id]]
+    return results
     
 
 
 ######################## Model Interactions ########################
 
 #gets list of all model metadata
+@ttl_cached("models")
 def get_all_models():
-    response = requests.get(DATABASE_URL+"/models")
+    response = dms_client.get("/models")
 
     if response.status_code == 200:
         data = response.json()
@@ -174,6 +391,7 @@ def get_all_models():
         raise Exception("Error Retrieving Model Data")
 
 #gets a list of all model names
+@ttl_cached("models")
 def get_all_model_names():
     models = get_all_models()
 
@@ -200,7 +418,7 @@ def get_all_model_names():
 #checks if the model name already exists
 def model_name_exists(model_name):
     params = {"model_name": model_name}
-    response = requests.get(DATABASE_URL+"/models/name", params = params)
+    response = dms_client.get("/models/name", params = params)
 
     if response.status_code == 200:
         data = response.json()
@@ -211,10 +429,11 @@ def model_name_exists(model_name):
         raise Exception("Error Retrieving Model Data")
 
 #gets path to model, assumes DMS and IPS on same machine. 
+@ttl_cached("models")
 def get_model_path(model_name):
     
     params = {"model_name": model_name}
-    response = requests.get(DATABASE_URL+"/models/path", params = params)
+    response = dms_client.get("/models/path", params = params)
 
     if response.status_code == 200:
         data = response.json()
@@ -223,26 +442,123 @@ def get_model_path(model_name):
         print(f"Failed Status code: {response.status_code}")
         raise Exception("Error Retrieving Model Data")
 
-#saves model metadata and weights to DMS
+#file an unfinished save keeps the id of the model document it created in, next to the weights
+#saving again reuses that model document, so the upload resumes instead of starting over under a new model
+def upload_state_path(model_path):
+    return os.path.join(os.path.dirname(model_path), "upload_state.json")
+
+def read_upload_state(model_path):
+    try:
+        with open(upload_state_path(model_path), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_upload_state(model_path, state):
+    write_json_atomic(upload_state_path(model_path), state)
+
+#saves model metadata and weights to DMS, a save that failed part way resumes when called again
 #param: model_doc: dict of model metadata
-def save_model(model_doc):
+#param: progress_callback: called with (bytes sent, total bytes) while the weights upload
+def save_model(model_doc, progress_callback=None):
+    model_path = os.path.join(WORKING_DIR,"runs",model_doc["name"],"weights","best.pt")
+    sha256 = file_checksum(model_path)
+
+    state = read_upload_state(model_path)
+    if state is not None and state.get("name") == model_doc["name"] and state.get("sha256") == sha256:
+        model_id = state["model_id"]
+        print(f"Resuming save of model {model_doc['name']}")
+    else:
+        response = dms_client.post("/models",json = model_doc)
+        if response.status_code != 200:
+            print(f"Failed Status code: {response.status_code}")
+            raise Exception("Error Retrieving Model Data")
 
-    response = requests.post(DATABASE_URL+"/models",json = model_doc)
-    if response.status_code == 200:
-        data = response.json()
-        model_id = data["id"]
+        invalidate("models")
+        model_id = response.json()["id"]
+        write_upload_state(model_path, {"name": model_doc["name"], "model_id": model_id, "sha256": sha256})
+
+    upload_model(model_id,model_path,progress_callback,sha256=sha256)
+    os.remove(upload_state_path(model_path))
 
-        model_path = os.path.join(WORKING_DIR,"runs",model_doc["name"],"weights","best.pt")
-        upload_model(model_id,model_path)
+#starts or resumes a chunked weights upload
+#returns {"upload_id", "received": bytes the DMS already holds, "exists": True if it has weights with this hash},
+#or None if the DMS has no chunked upload endpoint
+def start_model_upload(model_id, sha256, size, chunk_size):
+    data = {"model_id": model_id, "sha256": sha256, "size": size, "chunk_size": chunk_size}
+    # starting twice returns the same upload, so it is safe to retry
+    response = dms_client.post("/models/upload", json = data, idempotent=True)
 
+    if response.status_code in (404, 405):
+        return None
+    if response.status_code == 200:
+        return response.json()
     else:
         print(f"Failed Status code: {response.status_code}")
-        raise Exception("Error Retrieving Model Data")
+        raise Exception("Error Starting Model Upload")
+
+#sends the chunk of weights starting at offset, returns how many bytes the DMS holds after it
+def upload_model_chunk(upload_id, offset, chunk):
+    params = {"upload_id": upload_id, "offset": offset}
+    headers = {"Content-Type": "application/octet-stream"}
+    response = dms_client.request("PUT", "/models/upload/chunk", params = params, data = chunk, headers = headers)
+
+    check_transient(response)
+    # 409: the DMS holds a different amount than offset, it says where to carry on from
+    if response.status_code in (200, 409):
+        return response.json()["received"]
+    else:
+        print(f"Failed Status code: {response.status_code}")
+        raise Exception("Error Uploading Model Chunk")
+
+#lets the DMS check the hash of the received weights and attach them to the model
+def complete_model_upload(upload_id):
+    response = dms_client.post("/models/upload/complete", json = {"upload_id": upload_id}, idempotent=True)
+
+    if response.status_code != 200:
+        print(f"Failed Status code: {response.status_code}")
+        raise Exception("Error Saving Model")
 
-#uploads model weights to DMS
+#uploads model weights to DMS in chunks, an interrupted upload resumes from the last chunk the DMS acknowledged
+#weights the DMS already holds are not sent again
+#failed chunks are retried by the DMS client, an upload that still fails resumes the next time it is started for the model
 #param: model_id: id of model
 #param: model_path: current path of weights to be uploaded
-def upload_model(model_id,model_path):
+#param: progress_callback: called with (bytes sent, total bytes)
+#param: sha256: checksum of the weights if already known
+def upload_model(model_id,model_path,progress_callback=None,chunk_size=MODEL_UPLOAD_CHUNK_MB * 1024 * 1024,sha256=None):
+    size = os.path.getsize(model_path)
+    upload = start_model_upload(model_id, sha256 or file_checksum(model_path), size, chunk_size)
+
+    if upload is None:
+        upload_model_file(model_id, model_path)
+    elif not upload["exists"]:
+        offset = upload["received"]
+        if progress_callback is not None:
+            progress_callback(offset, size)
+
+        with open(model_path, "rb") as f:
+            while offset < size:
+                f.seek(offset)
+                chunk = f.read(chunk_size)
+                received = upload_model_chunk(upload["upload_id"], offset, chunk)
+                # a DMS that does not move past offset would be sent the same chunk forever
+                if received <= offset:
+                    raise Exception(f"DMS did not accept the model chunk at offset {offset}, it holds {received} bytes")
+                offset = received
+                if progress_callback is not None:
+                    progress_callback(offset, size)
+
+        complete_model_upload(upload["upload_id"])
+
+    if progress_callback is not None:
+        progress_callback(size, size)
+
+    # the model now has its weights path
+    invalidate("models")
+
+#uploads model weights to DMS as one request, for DMS versions without chunked uploads
+def upload_model_file(model_id,model_path):
    
     # Open file in binary mode
     with open(model_path, "rb") as f:
@@ -254,7 +570,7 @@ def upload_model(model_id,model_path):
             "model_id": model_id
         }
 
-        response = requests.post(f"{DATABASE_URL}/models/path", files=files, data=data)
+        response = dms_client.post("/models/path", files=files, data=data)
         if response.status_code != 200:
             print(f"Failed Status code: {response.status_code}")
-            raise Exception("Error Saving Model")
\ No newline at end of file
+            raise Exception("Error Saving Model")
@@ -0,0 +1,164 @@
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import PoolManager
+from urllib3.util.retry import Retry
+from config import DATABASE_URL, DMS_POOL_SIZE, DMS_RETRIES, DMS_BACKOFF, DMS_TIMEOUT, DMS_TIMEOUTS
+
+#this file holds the HTTP client every db function goes through
+#connections to the DMS are kept alive and reused from a pool shared by all threads, every request has a timeout,
+#and requests that are safe to repeat are retried with backoff when the connection fails or the DMS is overloaded
+
+
+# methods the DMS treats as safe to repeat
+IDEMPOTENT_METHODS = frozenset(["GET", "HEAD", "OPTIONS", "PUT", "DELETE"])
+
+# statuses worth retrying an idempotent request on
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+#pool manager that keeps track of the connection pools it hands out, so their counters can be read
+class TrackingPoolManager(PoolManager):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._pools_seen = set()
+        self._pools_lock = threading.Lock()
+
+    def connection_from_host(self, *args, **kwargs):
+        pool = super().connection_from_host(*args, **kwargs)
+        with self._pools_lock:
+            self._pools_seen.add(pool)
+        return pool
+
+    #every pool handed out so far
+    def pools_seen(self):
+        with self._pools_lock:
+            return list(self._pools_seen)
+
+    def clear(self):
+        super().clear()
+        with self._pools_lock:
+            self._pools_seen.clear()
+
+
+#HTTPAdapter whose connection pools can be inspected
+class TrackingAdapter(HTTPAdapter):
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        super().init_poolmanager(connections, maxsize, block, **pool_kwargs)
+        self.poolmanager = TrackingPoolManager(num_pools=connections, maxsize=maxsize, block=block, **pool_kwargs)
+
+
+#pooled, thread safe client for the DMS
+#timeouts: dict of path -> (connect, read) seconds for endpoints that need longer than default_timeout
+class DMSClient:
+    def __init__(self, base_url=DATABASE_URL, pool_size=DMS_POOL_SIZE, retries=DMS_RETRIES, backoff=DMS_BACKOFF,
+                 default_timeout=DMS_TIMEOUT, timeouts=DMS_TIMEOUTS):
+        self.base_url = base_url.rstrip("/")
+        self.default_timeout = tuple(default_timeout)
+        self.timeouts = {path: tuple(timeout) for path, timeout in timeouts.items()}
+
+        # one adapter per retry policy, their connection pools are shared by every thread's session
+        # connection failures are retried for any method since nothing reached the DMS, anything else only for idempotent ones
+        self._adapters = {
+            False: self._make_adapter(pool_size, retries, backoff, IDEMPOTENT_METHODS),
+            True: self._make_adapter(pool_size, retries, backoff, None),
+        }
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._errors = 0
+        self._retries = 0
+        self._seconds = 0.0
+
+    @staticmethod
+    def _make_adapter(pool_size, retries, backoff, allowed_methods):
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            allowed_methods=allowed_methods,
+            status_forcelist=RETRY_STATUSES,
+            backoff_factor=backoff,
+            raise_on_status=False,
+            respect_retry_after_header=True,
+        )
+        return TrackingAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry, pool_block=True)
+
+    # requests.Session is not thread safe, so each thread gets its own session mounted on the shared adapters
+    def _session(self, idempotent):
+        sessions = getattr(self._local, "sessions", None)
+        if sessions is None:
+            sessions = {}
+            for key, adapter in self._adapters.items():
+                session = requests.Session()
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                sessions[key] = session
+            self._local.sessions = sessions
+        return sessions[idempotent]
+
+    def timeout_for(self, path):
+        return self.timeouts.get(path, self.default_timeout)
+
+    #sends a request to path on the DMS and returns the response
+    #idempotent: True for requests safe to repeat whatever their method, e.g. lookups sent as POST
+    def request(self, method, path, timeout=None, idempotent=False, **kwargs):
+        method = method.upper()
+        session = self._session(idempotent)
+        start = time.perf_counter()
+        try:
+            response = session.request(method, self.base_url + path, timeout=timeout or self.timeout_for(path), **kwargs)
+        except requests.RequestException:
+            with self._lock:
+                self._requests += 1
+                self._errors += 1
+                self._seconds += time.perf_counter() - start
+            raise
+
+        retries = getattr(response.raw, "retries", None)
+        with self._lock:
+            self._requests += 1
+            self._seconds += time.perf_counter() - start
+            if retries is not None:
+                self._retries += len(retries.history)
+            if response.status_code >= 400:
+                self._errors += 1
+        return response
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request("DELETE", path, **kwargs)
+
+    #request counts and how well connections are being reused
+    def stats(self):
+        opened = 0
+        pool_requests = 0
+        for adapter in self._adapters.values():
+            for pool in adapter.poolmanager.pools_seen():
+                opened += pool.num_connections
+                pool_requests += pool.num_requests
+        with self._lock:
+            return {
+                "requests": self._requests,
+                "errors": self._errors,
+                "retries": self._retries,
+                "mean_seconds": self._seconds / self._requests if self._requests else 0.0,
+                "connections_opened": opened,
+                "connection_reuse": 1 - opened / pool_requests if pool_requests else 0.0,
+            }
+
+    #closes every pooled connection
+    def close(self):
+        for adapter in self._adapters.values():
+            adapter.close()
+
+
+#process wide client shared by every db function
+dms_client = DMSClient()
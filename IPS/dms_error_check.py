@@ -0,0 +1,77 @@
+import socket
+import requests
+import db
+from dms_client import DMSClient
+
+#this file checks that db tells DMS requests that never arrived apart from ones that may have, using real connections
+#a request that never arrived can be sent again even where the DMS does not dedupe, so a DMS restart does not abort a job
+#needs no DMS, port 9 on this machine must have nothing listening
+#run from the IPS folder: python dms_error_check.py
+#exits with 1 if a check failed
+
+CLOSED_URL = "http://127.0.0.1:9"
+
+
+def check(condition, message):
+    if not condition:
+        raise Exception(f"DMS error check failed: {message}")
+
+#returns the error sending one annotation to the DMS at base_url raised
+def send_error(base_url, timeout=None):
+    client = DMSClient(base_url, backoff=0)
+    try:
+        client.post("/annotations", json={"photo_id": "check"}, timeout=timeout)
+    except requests.RequestException as e:
+        return e
+    finally:
+        client.close()
+    raise Exception(f"Nothing failed sending to {base_url}")
+
+
+#a refused connection never reached the DMS
+def check_refused():
+    error = send_error(CLOSED_URL)
+    check(db.not_received(error), f"refused connection counted as possibly received: {error!r}")
+    print("refused connection: not received")
+
+#a request the DMS accepted the connection for but never answered may have been received
+def check_unanswered():
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen()
+    try:
+        error = send_error(f"http://127.0.0.1:{listener.getsockname()[1]}", timeout=(5, 0.5))
+    finally:
+        listener.close()
+    check(isinstance(error, requests.ReadTimeout), f"unanswered request raised {error!r}")
+    check(not db.not_received(error), "unanswered request counted as not received")
+    print("unanswered request: possibly received")
+
+#per photo uploads to a DMS that is down are all worth retrying, so the job waits for the DMS instead of aborting
+def check_per_photo_upload():
+    client, supported = db.dms_client, db._batch_upload_supported
+    db.dms_client = DMSClient(CLOSED_URL, backoff=0)
+    db._batch_upload_supported = False
+    entries = [{"photo_id": f"check-{index}", "classes": ["tree"], "annotation": []} for index in range(3)]
+    try:
+        db.upload_annotations_batch(entries)
+    except db.PartialBatchError as e:
+        check(isinstance(e, db.TransientPartialBatchError), f"per photo uploads to a DMS that is down raised {e!r}")
+        check(len(e.remaining) == len(entries), f"{len(e.remaining)} of {len(entries)} uploads left to send")
+    else:
+        raise Exception("DMS error check failed: per photo uploads to a DMS that is down did not fail")
+    finally:
+        db.dms_client.close()
+        db.dms_client, db._batch_upload_supported = client, supported
+    print("per photo uploads to a DMS that is down: retryable")
+
+
+def main():
+    check_refused()
+    check_unanswered()
+    check_per_photo_upload()
+    print("DMS error check passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+import hashlib
+import os
+import shutil
+import threading
+import numpy as np
+from config import EMBEDDING_CACHE_DIR, EMBEDDING_CACHE_MAX_MB
+from file_lock import file_lock
+
+#this file keeps SAM2 image encoder outputs on disk so an image is only encoded once
+#the encoder output depends only on the image, so runs with other generator thresholds or point densities reuse it
+#each entry is a folder of .npy files that are memory mapped back in, the store evicts least recently used entries past its size budget
+
+
+#hash of an image array, used to key its embeddings
+def array_hash(image):
+    image = np.ascontiguousarray(image)
+    digest = hashlib.sha256()
+    digest.update(str((image.shape, image.dtype.str)).encode())
+    digest.update(image.data)
+    return digest.hexdigest()
+
+
+#on disk store of SAM2 image embeddings
+#several processes may share one store, the size budget holds for the store as a whole since eviction
+#rescans the folder under a lock every process takes
+class EmbeddingCache:
+    def __init__(self, root=EMBEDDING_CACHE_DIR, max_mb=EMBEDDING_CACHE_MAX_MB):
+        self.root = root
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._lock = threading.Lock()
+        self._lock_path = os.path.join(root, ".lock")
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(root, exist_ok=True)
+        # entry sizes, entries are never rewritten so a size stays valid for as long as the entry exists
+        self._sizes = {}
+
+    #returns {"image_embed": array, "high_res_feats": [arrays]} memory mapped from disk, or None
+    def get(self, key):
+        path = os.path.join(self.root, key)
+        with self._lock:
+            # entries written by other processes are found on disk
+            if not os.path.isdir(path):
+                self.misses += 1
+                return None
+            try:
+                image_embed = np.load(os.path.join(path, "image_embed.npy"), mmap_mode="c")
+                high_res_feats = []
+                level = 0
+                while os.path.exists(os.path.join(path, f"high_res_feats_{level}.npy")):
+                    high_res_feats.append(np.load(os.path.join(path, f"high_res_feats_{level}.npy"), mmap_mode="c"))
+                    level += 1
+                # the modification time orders entries for eviction
+                os.utime(path)
+            except (OSError, ValueError):
+                # a damaged entry, or one another process evicted while it was read, counts as a miss
+                with file_lock(self._lock_path):
+                    self._remove(key)
+                self.misses += 1
+                return None
+
+            self.hits += 1
+        return {"image_embed": image_embed, "high_res_feats": high_res_feats}
+
+    #stores the embeddings of an image, arrays are written to a temporary folder then moved into place
+    def put(self, key, image_embed, high_res_feats):
+        temp_path = os.path.join(self.root, f".{key}.{os.getpid()}.{threading.get_ident()}.tmp")
+        os.makedirs(temp_path, exist_ok=True)
+        np.save(os.path.join(temp_path, "image_embed.npy"), image_embed)
+        for level, feats in enumerate(high_res_feats):
+            np.save(os.path.join(temp_path, f"high_res_feats_{level}.npy"), feats)
+        size = self._folder_size(temp_path)
+
+        with self._lock, file_lock(self._lock_path):
+            path = os.path.join(self.root, key)
+            if os.path.isdir(path):
+                shutil.rmtree(temp_path, ignore_errors=True)
+                return
+            os.replace(temp_path, path)
+            self._sizes[key] = size
+            self._evict_over_budget(keep=key)
+
+    def size_bytes(self):
+        with self._lock, file_lock(self._lock_path):
+            return sum(size for _, _, size in self._scan())
+
+    #every entry in the store as (last use, key, size), oldest use first
+    def _scan(self):
+        entries = []
+        for key in os.listdir(self.root):
+            path = os.path.join(self.root, key)
+            if key.startswith("."):
+                continue
+            try:
+                last_used = os.path.getmtime(path)
+                if key not in self._sizes:
+                    self._sizes[key] = self._folder_size(path)
+            except OSError:
+                # removed by another process since it was listed
+                self._sizes.pop(key, None)
+                continue
+            entries.append((last_used, key, self._sizes[key]))
+        known = {key for _, key, _ in entries}
+        for key in list(self._sizes):
+            if key not in known:
+                del self._sizes[key]
+        return sorted(entries)
+
+    # must hold the store lock
+    def _evict_over_budget(self, keep=None):
+        entries = self._scan()
+        total = sum(size for _, _, size in entries)
+        for _, key, size in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= size
+            self._remove(key)
+            self.evictions += 1
+
+    def _remove(self, key):
+        self._sizes.pop(key, None)
+        shutil.rmtree(os.path.join(self.root, key), ignore_errors=True)
+
+    @staticmethod
+    def _folder_size(path):
+        return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+#makes a SAM2 mask generator look up image embeddings in the cache before running the image encoder
+#fingerprint must identify the SAM2 checkpoint, config and precision the embeddings came from
+def attach_embedding_cache(mask_generator, cache, fingerprint):
+    import torch
+
+    predictor = mask_generator.predictor
+    encode_image = predictor.set_image
+
+    def to_tensor(array):
+        return torch.from_numpy(array).to(predictor.device)
+
+    @torch.no_grad()
+    def set_image(image):
+        if not isinstance(image, np.ndarray):
+            return encode_image(image)
+
+        key = hashlib.sha256((fingerprint + array_hash(image)).encode()).hexdigest()
+        cached = cache.get(key)
+        if cached is not None:
+            # same state set_image leaves behind, without running the encoder
+            predictor.reset_predictor()
+            predictor._orig_hw = [image.shape[:2]]
+            predictor._features = {
+                "image_embed": to_tensor(cached["image_embed"]),
+                "high_res_feats": [to_tensor(feats) for feats in cached["high_res_feats"]],
+            }
+            predictor._is_image_set = True
+            predictor._is_batch = False
+            return
+
+        encode_image(image)
+        features = predictor._features
+        cache.put(
+            key,
+            features["image_embed"].detach().cpu().numpy(),
+            [feats.detach().cpu().numpy() for feats in features["high_res_feats"]],
+        )
+
+    predictor.set_image = set_image
+    return mask_generator
@@ -0,0 +1,32 @@
+import contextlib
+import os
+
+#this file holds a lock on a file that is shared by every process on the machine
+#used where worker processes write to the same files, such as the ONNX exports and the embedding cache
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+
+#holds an exclusive lock on path for the duration of the with block, waiting for other processes that hold it
+#the lock file is created if needed and left in place for the next user
+@contextlib.contextmanager
+def file_lock(path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
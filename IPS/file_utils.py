@@ -0,0 +1,23 @@
+import hashlib
+import json
+import os
+
+#this file holds the file helpers shared by the caches, the dataset manifest, the shard reports and model uploads
+
+
+#sha256 of a file's contents, read chunk_size bytes at a time so large weights never sit in memory whole
+def file_checksum(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+#writes data to path as json through a temporary file, so a reader never sees a half written file
+#the folder is created if needed
+def write_json_atomic(path, data, indent=None):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=indent)
+    os.replace(temp_path, path)
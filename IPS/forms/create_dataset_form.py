@@ -2,8 +2,9 @@ import forms.gui_utils as gui_utils
 import db
 import worker_threads as worker
 from system import system_instance
+from sam2_presets import SAM2_PRESETS, DEFAULT_SAM2_PRESET
 from PyQt6.QtWidgets import (
-    QWidget, QPushButton, QLineEdit, QLabel,
+    QWidget, QPushButton, QLineEdit, QLabel, QComboBox,
     QHBoxLayout, QVBoxLayout, QFormLayout, QSpacerItem, QSizePolicy, QMessageBox
 )
 from PyQt6.QtGui import QCloseEvent
@@ -75,6 +76,12 @@ class DatasetCreatorForm(QWidget):
         split_layout.addWidget(QLabel("Val"))
         split_layout.addWidget(self.val_input)
         split_form_layout.addRow("Dataset Split:", split_layout)
+
+        # SAM2 speed / quality preset used when annotating
+        self.preset_input = QComboBox()
+        self.preset_input.addItems(SAM2_PRESETS.keys())
+        self.preset_input.setCurrentText(DEFAULT_SAM2_PRESET)
+        split_form_layout.addRow("Annotation Preset:", self.preset_input)
     
         
 
@@ -241,7 +248,7 @@ class DatasetCreatorForm(QWidget):
         display.finished.connect(self.handle_worker_completion)
 
         # Start background worker
-        self.worker = worker.DatasetWorker(dataset_name,form_data=form_data,split=split_string, classes= self.classes)
+        self.worker = worker.DatasetWorker(dataset_name,form_data=form_data,split=split_string, classes= self.classes, preset=self.preset_input.currentText())
         self.worker.progress.connect(display.update_progress)
         self.worker.error.connect(self.handle_worker_error)
         self.worker.start()
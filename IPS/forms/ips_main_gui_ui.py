@@ -0,0 +1,68 @@
+# Form implementation generated from reading ui file 'forms/ips_main_gui.ui'
+#
+# Created by: PyQt6 UI code generator 6.7.1
+#
+# WARNING: Any manual changes made to this file will be lost when pyuic6 is
+# run again.  Do not edit this file unless you know what you are doing.
+
+
+from PyQt6 import QtCore, QtGui, QtWidgets
+
+
+class Ui_MainWindow(object):
+    def setupUi(self, MainWindow):
+        MainWindow.setObjectName("MainWindow")
+        MainWindow.resize(1200, 800)
+        self.centralwidget = QtWidgets.QWidget(parent=MainWindow)
+        self.centralwidget.setObjectName("centralwidget")
+        self.train_model_button = QtWidgets.QPushButton(parent=self.centralwidget)
+        self.train_model_button.setGeometry(QtCore.QRect(10, 150, 171, 31))
+        self.train_model_button.setObjectName("train_model_button")
+        self.validate_model_button = QtWidgets.QPushButton(parent=self.centralwidget)
+        self.validate_model_button.setGeometry(QtCore.QRect(10, 190, 171, 31))
+        self.validate_model_button.setObjectName("validate_model_button")
+        self.line = QtWidgets.QFrame(parent=self.centralwidget)
+        self.line.setGeometry(QtCore.QRect(0, 210, 181, 51))
+        self.line.setFrameShape(QtWidgets.QFrame.Shape.HLine)
+        self.line.setFrameShadow(QtWidgets.QFrame.Shadow.Sunken)
+        self.line.setObjectName("line")
+        self.listWidget = QtWidgets.QListWidget(parent=self.centralwidget)
+        self.listWidget.setGeometry(QtCore.QRect(220, 10, 900, 700))
+        self.listWidget.setObjectName("listWidget")
+        self.save_model_button = QtWidgets.QPushButton(parent=self.centralwidget)
+        self.save_model_button.setGeometry(QtCore.QRect(520, 720, 200, 31))
+        self.save_model_button.setObjectName("save_model_button")
+        self.label = QtWidgets.QLabel(parent=self.centralwidget)
+        self.label.setGeometry(QtCore.QRect(10, 120, 111, 21))
+        self.label.setObjectName("label")
+        self.label_3 = QtWidgets.QLabel(parent=self.centralwidget)
+        self.label_3.setGeometry(QtCore.QRect(10, 10, 131, 20))
+        self.label_3.setObjectName("label_3")
+        self.create_dataset_button = QtWidgets.QPushButton(parent=self.centralwidget)
+        self.create_dataset_button.setGeometry(QtCore.QRect(10, 30, 171, 31))
+        self.create_dataset_button.setObjectName("create_dataset_button")
+        self.load_dataset_button = QtWidgets.QPushButton(parent=self.centralwidget)
+        self.load_dataset_button.setGeometry(QtCore.QRect(10, 70, 171, 31))
+        self.load_dataset_button.setObjectName("load_dataset_button")
+        self.line_2 = QtWidgets.QFrame(parent=self.centralwidget)
+        self.line_2.setGeometry(QtCore.QRect(0, 90, 181, 51))
+        self.line_2.setFrameShape(QtWidgets.QFrame.Shape.HLine)
+        self.line_2.setFrameShadow(QtWidgets.QFrame.Shadow.Sunken)
+        self.line_2.setObjectName("line_2")
+        MainWindow.setCentralWidget(self.centralwidget)
+        self.statusbar = QtWidgets.QStatusBar(parent=MainWindow)
+        self.statusbar.setObjectName("statusbar")
+        MainWindow.setStatusBar(self.statusbar)
+
+        self.retranslateUi(MainWindow)
+
+    def retranslateUi(self, MainWindow):
+        _translate = QtCore.QCoreApplication.translate
+        MainWindow.setWindowTitle(_translate("MainWindow", "MainWindow"))
+        self.train_model_button.setText(_translate("MainWindow", "Train_Model"))
+        self.validate_model_button.setText(_translate("MainWindow", "Validate Model"))
+        self.save_model_button.setText(_translate("MainWindow", "Save Model"))
+        self.label.setText(_translate("MainWindow", "Model Training"))
+        self.label_3.setText(_translate("MainWindow", "Dataset Creation"))
+        self.create_dataset_button.setText(_translate("MainWindow", "Create Dataset"))
+        self.load_dataset_button.setText(_translate("MainWindow", "LoadDataset"))
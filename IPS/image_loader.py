@@ -0,0 +1,124 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+from config import PREFETCH_DEPTH, PREFETCH_WORKERS
+
+#this file decodes and preprocesses images ahead of the models that use them
+#OpenCV releases the GIL while decoding and resizing so a thread pool decodes in parallel
+
+
+# shrink image to make processing faster
+def preprocess_image(image_rgb, target_size=1024):
+    height, width = image_rgb.shape[:2]
+
+    if max(height, width) > target_size:
+        scale = target_size / max(height, width)
+        new_width = int(width * scale)
+        new_height = int(height * scale)
+        image_rgb = cv2.resize(image_rgb, (new_width, new_height), interpolation=cv2.INTER_AREA)
+
+    return image_rgb
+
+# JPEG decoders can scale by these factors while decoding, far cheaper than decoding in full and resizing
+REDUCED_DECODE_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+JPEG_EXTENSIONS = ('.jpg', '.jpeg')
+
+# start of frame markers, these hold the image size
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+#reads (width, height) from a JPEG header without decoding it, None if it cannot be found
+def jpeg_size(image_path):
+    with open(image_path, "rb") as f:
+        if f.read(2) != b"\xff\xd8":
+            return None
+        while True:
+            byte = f.read(1)
+            while byte and byte != b"\xff":
+                byte = f.read(1)
+            while byte == b"\xff":
+                byte = f.read(1)
+            if not byte:
+                return None
+
+            marker = byte[0]
+            if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+                continue  # markers without a payload
+            if marker in (0xD9, 0xDA):
+                return None  # reached the image data without finding a frame header
+
+            length = int.from_bytes(f.read(2), "big")
+            if marker in _SOF_MARKERS:
+                header = f.read(5)
+                if len(header) < 5:
+                    return None
+                height = int.from_bytes(header[1:3], "big")
+                width = int.from_bytes(header[3:5], "big")
+                return width, height
+            f.seek(length - 2, 1)
+
+#picks the largest decode time reduction that keeps the longest side at or above target_size
+def decode_flag(image_path, target_size=1024):
+    if not image_path.lower().endswith(JPEG_EXTENSIONS):
+        return cv2.IMREAD_COLOR
+    try:
+        size = jpeg_size(image_path)
+    except OSError:
+        size = None
+    if size is None:
+        return cv2.IMREAD_COLOR
+
+    longest = max(size)
+    for factor, flag in REDUCED_DECODE_FLAGS:
+        # libjpeg rounds reduced dimensions up
+        if -(-longest // factor) >= target_size:
+            return flag
+    return cv2.IMREAD_COLOR
+
+#loads an image as preprocessed RGB, returns None if it cannot be read
+#large JPEGs are decoded at a reduced scale and then finished with the usual resize
+def load_image(image_path, target_size=1024):
+    image = cv2.imread(image_path, decode_flag(image_path, target_size))
+    if image is None:
+        print(f"Error: Could not load image {image_path}")
+        return None
+
+    image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    return preprocess_image(image_rgb, target_size=target_size)
+
+
+#iterates over (image_path, image_rgb) pairs, decoding up to depth images ahead on a pool of worker threads
+#images come out in the same order as their paths, unreadable images are skipped
+#loader can replace load_image, it is called as loader(image_path, target_size) and returns None to skip the image
+class ImagePrefetcher:
+    def __init__(self, image_paths, depth=PREFETCH_DEPTH, workers=PREFETCH_WORKERS, target_size=1024, loader=load_image):
+        self.image_paths = image_paths
+        self.depth = max(1, depth)
+        self.workers = max(1, workers)
+        self.target_size = target_size
+        self.loader = loader
+
+    def __iter__(self):
+        paths = iter(self.image_paths)
+        pending = deque()
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="image-prefetch") as executor:
+            try:
+                for image_path in paths:
+                    pending.append((image_path, executor.submit(self.loader, image_path, self.target_size)))
+                    if len(pending) >= self.depth:
+                        break
+
+                while pending:
+                    image_path, future = pending.popleft()
+
+                    # keep the pool topped up before waiting on the next image
+                    next_path = next(paths, None)
+                    if next_path is not None:
+                        pending.append((next_path, executor.submit(self.loader, next_path, self.target_size)))
+
+                    image_rgb = future.result()
+                    if image_rgb is not None:
+                        yield image_path, image_rgb
+            finally:
+                for _, future in pending:
+                    future.cancel()
@@ -0,0 +1,130 @@
+import functools
+import os
+import shutil
+import tempfile
+import threading
+from config import INFERENCE_BACKEND, VERIFY_IMGSZ
+from file_lock import file_lock
+
+#this file decides how the verification ensemble is run, PyTorch when a GPU is available,
+#ONNX Runtime on CPU only machines
+
+
+#picks the device torch models should run on
+@functools.lru_cache(maxsize=None)
+def select_device():
+    import torch
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+#checks if ONNX Runtime is installed without importing it
+def onnxruntime_available():
+    import importlib.util
+    return importlib.util.find_spec("onnxruntime") is not None
+
+
+#runs checkpoints with PyTorch on the given device
+class TorchBackend:
+    name = "torch"
+
+    def __init__(self, device=None):
+        self.device = device or select_device()
+
+    #nothing to prepare, checkpoints are loaded as they are
+    def prepare(self, model_path):
+        return model_path
+
+    def load(self, model_path):
+        from ultralytics import YOLO
+
+        model = YOLO(model_path)
+        model.eval()
+        model.to(self.device)
+        return model
+
+
+#runs checkpoints with ONNX Runtime on CPU, exporting each checkpoint on first use
+#the exported graph is cached next to the .pt file and reused until the checkpoint changes
+#exports are written to a temporary folder and moved into place under a lock shared by every process,
+#so a worker never loads a graph another worker is still writing
+class OnnxRuntimeBackend:
+    name = "onnx"
+    _export_lock = threading.Lock()
+
+    def __init__(self, imgsz=VERIFY_IMGSZ):
+        self.imgsz = imgsz
+
+    #path the exported graph for a checkpoint is cached at
+    @staticmethod
+    def onnx_path(model_path):
+        return os.path.splitext(model_path)[0] + ".onnx"
+
+    #exports the checkpoint to ONNX unless an up to date export already exists
+    def export(self, model_path):
+        onnx_path = self.onnx_path(model_path)
+        with self._export_lock, file_lock(f"{onnx_path}.lock"):
+            if os.path.exists(onnx_path) and os.path.getmtime(onnx_path) >= os.path.getmtime(model_path):
+                return onnx_path
+
+            from ultralytics import YOLO
+
+            print(f"Exporting {model_path} to ONNX")
+            # ultralytics writes the export next to the checkpoint it was given, so export a copy in a folder of its own
+            with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(onnx_path))) as temp_dir:
+                temp_model = os.path.join(temp_dir, os.path.basename(model_path))
+                shutil.copy2(model_path, temp_model)
+                # dynamic axes so crops can be verified in batches of any size and shape
+                exported = YOLO(temp_model).export(format="onnx", dynamic=True, imgsz=self.imgsz, device="cpu", verbose=False)
+                os.replace(exported, onnx_path)
+            return onnx_path
+
+    #exports ahead of time so processes started later only load the graph
+    def prepare(self, model_path):
+        return self.export(model_path)
+
+    def load(self, model_path):
+        from ultralytics import YOLO
+
+        return YOLO(self.export(model_path), task="detect")
+
+
+#creates the backend by name, auto picks PyTorch on GPU, then ONNX Runtime, then PyTorch on CPU
+def create_backend(name=INFERENCE_BACKEND):
+    if name == "torch":
+        return TorchBackend()
+    if name == "onnx":
+        if not onnxruntime_available():
+            raise Exception("The onnx inference backend needs onnxruntime installed")
+        return OnnxRuntimeBackend()
+    if name != "auto":
+        raise Exception(f"Unknown inference backend {name}")
+
+    if select_device() == "cuda":
+        return TorchBackend("cuda")
+    if onnxruntime_available():
+        return OnnxRuntimeBackend()
+
+    print("Warning: no GPU or onnxruntime found, the verification ensemble will run with PyTorch on CPU")
+    return TorchBackend("cpu")
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+#the backend used by this process, created on first use
+def inference_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = create_backend()
+            print(f"Verification ensemble using the {_backend.name} backend")
+        return _backend
+
+#loads a checkpoint with the process backend
+def load_model(model_path):
+    return inference_backend().load(model_path)
+
+#does the one off work of loading checkpoints, such as ONNX exports, before worker processes start
+def prepare_models(model_paths):
+    backend = inference_backend()
+    for model_path in model_paths:
+        backend.prepare(model_path)
@@ -0,0 +1,145 @@
+from datetime import datetime
+from system import system_instance
+
+#this file holds the ultralytics callbacks that turn training and validation events into progress updates
+#the callbacks only need the signal attributes they emit on, so the QThread workers and the command line share them
+
+
+#callbacks for model.val, expects status_update and validation_finished attributes with an emit method
+class ValidationCallbacks:
+
+    def on_val_start(self,trainer):
+        self.status_update.emit("Validation Started")
+
+    def on_val_end(self, trainer):
+        metrics = trainer.metrics
+
+        # Ensure metrics are available before accessing them
+        if not metrics:
+            print("No metrics found.")
+            return
+
+        results = {
+            "mAP50": metrics.box.map50,
+            "mAP50_95": metrics.box.map,
+            "recall": metrics.box.mr,
+            "precision": metrics.box.mp,
+        }
+
+        self.validation_finished.emit(results)
+
+
+#callbacks for model.train, expects training_started, epoch_completed, training_finished, error_occurred,
+#status_update and prepare_save attributes with an emit method
+class TrainingCallbacks:
+
+    #sets up the counters the callbacks keep while a model trains
+    def reset_progress(self, config):
+        self.config = config  
+        self.best_mAP50 = 0
+        self.current_epoch = 0 
+        self.best_fitness = 0
+        self.start_time = None
+
+        self.total_epochs = self.config.get("epochs", 0)
+        if self.total_epochs == 0:
+            self.total_epochs = 100
+
+    def on_train_start(self,trainer):
+        """Called when training starts"""
+        self.start_time = datetime.now()
+        self.training_started.emit(f"Training started at {self.start_time.strftime('%H:%M:%S')}")
+        self.status_update.emit(f"Training for {self.total_epochs} epochs...")
+
+    def on_train_epoch_end(self, trainer):
+        """Called at the end of each epoch"""
+        try:
+            # Extract metrics from trainer
+            metrics = trainer.metrics 
+            
+            # Get key metrics (handle missing keys gracefully)
+            mAP50 = metrics.get('metrics/mAP50(B)', 0)
+            mAP50_95 = metrics.get('metrics/mAP50-95(B)', 0)
+            precision = metrics.get('metrics/precision(B)', 0)
+            recall = metrics.get('metrics/recall(B)', 0)
+            box_loss = metrics.get('val/box_loss', 0)
+            cls_loss = metrics.get('val/cls_loss', 0)
+            fitness = trainer.fitness
+            
+            # Track best fitness
+            if fitness is not None and fitness > self.best_fitness:
+                self.best_fitness = fitness
+                is_best = True
+            else:
+                is_best = False
+            
+            # Calculate elapsed time
+            elapsed = datetime.now() - self.start_time if self.start_time else None
+            elapsed_str = str(elapsed).split('.')[0] if elapsed else "Unknown"
+            self.current_epoch += 1
+            # Create metrics dictionary
+            epoch_metrics = {
+                'best_fitness' : self.best_fitness,
+                'epoch': self.current_epoch ,
+                'total_epochs': self.total_epochs,
+                'mAP50': mAP50,
+                'mAP50_95': mAP50_95,
+                'precision': precision,
+                'recall': recall,
+                'fitness':fitness,
+                'box_loss': box_loss,
+                'cls_loss': cls_loss,
+                'is_best': is_best,
+                'elapsed_time': elapsed_str,
+                'progress_percent': ((self.current_epoch) / self.total_epochs) * 100
+            }
+            
+            # Send metrics to main thread
+            self.epoch_completed.emit(epoch_metrics)
+            
+            
+            
+        except Exception as e:
+            self.error_occurred.emit(f"Error processing epoch metrics: {str(e)}")
+    
+    def on_train_end(self, trainer):
+        """Called when training completes"""
+        try:
+            total_time = datetime.now() - self.start_time if self.start_time else None
+            total_time_str = str(total_time).split('.')[0] if total_time else "Unknown"
+            
+            # Get final results
+            results = {
+                'completed_epochs': self.current_epoch,
+                'best_fitness': self.best_fitness,
+                'total_time': total_time_str,
+                'model_path': getattr(trainer, 'save_dir', 'Unknown'),
+                'success': True
+            }
+            #send results to trainingDisplay
+            self.training_finished.emit(results)
+            
+            # Initialize metadata dictionary
+            metadata = {}
+
+            # Retrieve metrics from trainer
+            metrics = trainer.metrics
+            metadata["best_mAP50"] = self.best_mAP50
+            metadata['mAP50'] = metrics.get('metrics/mAP50(B)', 0) 
+            metadata['AP50_95'] = metrics.get('metrics/mAP50-95(B)', 0)
+            metadata['precision'] = metrics.get('metrics/precision(B)', 0)
+            metadata['recall'] = metrics.get('metrics/recall(B)', 0)
+
+
+            doc = {}
+            doc["results"] = metadata
+            name = self.config.pop("name")
+            doc['config'] = self.config
+            doc['name'] = name
+            doc ['dataset_id'] = system_instance.loaded_dataset.id
+            self.prepare_save.emit(doc)
+
+            
+            
+        except Exception as e:
+            self.error_occurred.emit(f"Error in training completion: {str(e)}")
@@ -0,0 +1,137 @@
+import json
+import os
+import threading
+import time
+from config import JOURNAL_DIR, JOURNAL_FSYNC
+
+#this file keeps an append only journal per dataset of how far each image got through annotation
+#a restarted job reads it back and carries on from where it stopped instead of starting over
+
+
+# stages an image passes through, later stages imply the earlier ones
+# removing: queued for removal, the DMS removal or the delete of the local copy is not finished yet
+STAGES = ("masks", "verified", "removing", "uploaded", "removed")
+FINAL_STAGES = ("uploaded", "removed")
+
+
+#photo id of an image path, matches the id used by the DMS
+def photo_id_from_path(image_path):
+    return os.path.splitext(os.path.basename(image_path))[0]
+
+
+#append only record of annotation progress for one dataset
+#name: file name of the journal, defaults to the dataset id, jobs covering part of a dataset pass their own
+class JobJournal:
+    def __init__(self, dataset_id, root=JOURNAL_DIR, fsync=JOURNAL_FSYNC, name=None):
+        self.dataset_id = dataset_id
+        self.path = os.path.join(root, f"{name or dataset_id}.jsonl")
+        self.fsync = fsync
+        self.settings = {}
+        self.complete = False
+        self._stages = {}
+        self._annotations = {}
+        self._lock = threading.Lock()
+
+        os.makedirs(root, exist_ok=True)
+        self._load()
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    #true if a journal exists for the dataset and its job never finished
+    @staticmethod
+    def has_unfinished(dataset_id, root=JOURNAL_DIR):
+        path = os.path.join(root, f"{dataset_id}.jsonl")
+        if not os.path.exists(path):
+            return False
+        journal = JobJournal(dataset_id, root)
+        try:
+            return not journal.complete
+        finally:
+            journal.close()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # the last line may be cut short if the process died mid write
+                    continue
+                self._apply(entry)
+
+    def _apply(self, entry):
+        stage = entry.get("stage")
+        if stage == "job":
+            self.settings = entry.get("settings", {})
+            self.complete = False
+        elif stage == "complete":
+            self.complete = True
+        elif stage in STAGES:
+            photo_id = entry["photo_id"]
+            current = self._stages.get(photo_id)
+            if current is None or STAGES.index(stage) >= STAGES.index(current):
+                self._stages[photo_id] = stage
+            if stage == "verified":
+                self._annotations[photo_id] = entry.get("annotations", [])
+
+    def _append(self, entry):
+        entry["time"] = time.time()
+        line = json.dumps(entry) + "\n"
+        with self._lock:
+            self._apply(entry)
+            self._file.write(line)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+
+    #starts a job, a journal left by a finished job is archived so the new job starts clean
+    def start(self, settings):
+        if self.complete:
+            self._file.close()
+            os.replace(self.path, f"{self.path}.{int(time.time())}.done")
+            self.complete = False
+            self._stages = {}
+            self._annotations = {}
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._append({"stage": "job", "settings": settings})
+
+    #records that an image reached a stage, verified records carry the annotations so upload can resume without models
+    def record(self, image_path, stage, annotations=None):
+        entry = {"photo_id": photo_id_from_path(image_path), "stage": stage}
+        if stage == "verified":
+            entry["annotations"] = annotations or []
+        self._append(entry)
+
+    def mark_complete(self):
+        self._append({"stage": "complete"})
+
+    def stage(self, image_path):
+        with self._lock:
+            return self._stages.get(photo_id_from_path(image_path))
+
+    #true once an image needs no more work
+    def is_done(self, image_path):
+        return self.stage(image_path) in FINAL_STAGES
+
+    #annotations of an image that was verified but not yet uploaded, otherwise None
+    def pending_annotations(self, image_path):
+        photo_id = photo_id_from_path(image_path)
+        with self._lock:
+            if self._stages.get(photo_id) != "verified":
+                return None
+            return list(self._annotations[photo_id])
+
+    #photo ids whose latest stage is stage
+    def photo_ids(self, stage):
+        with self._lock:
+            return sorted(photo_id for photo_id, value in self._stages.items() if value == stage)
+
+    def counts(self):
+        with self._lock:
+            return {stage: sum(1 for value in self._stages.values() if value == stage) for stage in STAGES}
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
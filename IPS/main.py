@@ -1,10 +1,13 @@
 
+import time
+# taken before the other imports so --startup-time counts them
+STARTED = time.time()
+import json
 import sys
-import db
 import forms.gui_utils as gui
+import worker_threads as worker
 from PyQt6 import QtWidgets
-from PyQt6 import uic
-from PyQt6.QtCore import Qt
+from PyQt6.QtCore import Qt, QTimer
 from PyQt6.QtWidgets import QMessageBox
 from forms.create_dataset_form import DatasetCreatorForm
 from forms.load_dataset_form import DatasetLoaderForm
@@ -12,23 +15,25 @@ from forms.train_model_form import TrainModelConfigForm
 from forms.validate_model_form import ValidateModelForm
 from system import system_instance
 from forms.progress import TrainingMetricsDisplay, DatasetStatusDisplay, ValidateMetricDisplay
+from forms.ips_main_gui_ui import Ui_MainWindow
 
 
 
 data_list=[]
 
 
-class MainWindow(QtWidgets.QMainWindow):
+class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        # load pyqt6 gui base file
-        uic.loadUi("forms/ips_main_gui.ui", self)
+        # build the gui from the compiled base file, startup_time.py checks it is up to date with the .ui
+        self.setupUi(self)
 
         #reference to stop pop ups being garbage collected
         self.popup_ref =None
 
         self.process_going = False
+        self.upload_worker = None
     
         self.create_dataset_button.clicked.connect(self.create_dataset)
         self.load_dataset_button.clicked.connect(self.load_dataset)
@@ -97,7 +102,20 @@ class MainWindow(QtWidgets.QMainWindow):
         self.popup_ref.show()
 
     def save_model(self):
-        db.save_model(self.results_doc)
+        if self.upload_worker is not None and self.upload_worker.isRunning():
+            return
+
+        # weights upload on a worker thread so the window stays responsive
+        self.upload_worker = worker.ModelUploadWorker(self.results_doc)
+        if system_instance.display is not None:
+            self.upload_worker.progress.connect(system_instance.display.add_status_message)
+            self.upload_worker.finished_upload.connect(system_instance.display.add_status_message)
+        self.upload_worker.error_occurred.connect(self.upload_failed)
+        self.upload_worker.finished_upload.connect(lambda message: self.save_model_button.hide())
+        self.upload_worker.start()
+
+    def upload_failed(self, error):
+        gui.show_alert(QMessageBox.Icon.Warning, "Saving Error", "", f"Model could not be saved: {error}")
 
     def prepare_save(self,results_doc):
         self.save_model_button.show()
@@ -107,8 +125,20 @@ class MainWindow(QtWidgets.QMainWindow):
      
     
 
-# run the application
-app = QtWidgets.QApplication(sys.argv)
-window = MainWindow()
-window.show()
-app.exec()
+#prints how long the window took to show and which heavy modules were loaded, then quits
+#used by startup_time.py
+def report_startup_time():
+    heavy_modules = [name for name in ("torch", "ultralytics", "cv2", "sam2") if name in sys.modules]
+    print(json.dumps({"started": STARTED, "shown": time.time(), "heavy_modules": heavy_modules}), flush=True)
+    QtWidgets.QApplication.quit()
+
+
+# run the application, guarded so annotation worker processes can import this file without opening a window
+if __name__ == "__main__":
+    app = QtWidgets.QApplication(sys.argv)
+    window = MainWindow()
+    window.show()
+    if "--startup-time" in sys.argv:
+        # runs once the event loop has drawn the window
+        QTimer.singleShot(0, report_startup_time)
+    app.exec()
@@ -0,0 +1,120 @@
+import numpy as np
+
+#this file stores SAM2 masks compactly, cropped to the mask bounds and bit packed
+#a full size boolean mask costs H*W bytes, a compact mask costs roughly its bounding box area / 8
+
+
+#a binary mask cropped to its bounds and packed to one bit per pixel
+class CompactMask:
+    __slots__ = ("shape", "bounds", "packed")
+
+    # shape: (H, W) of the image the mask belongs to
+    # bounds: (y_min, y_max, x_min, x_max) with exclusive max, all zero for an empty mask
+    # packed: np.packbits of the cropped mask in row major order
+    def __init__(self, shape, bounds, packed):
+        self.shape = tuple(int(v) for v in shape)
+        self.bounds = tuple(int(v) for v in bounds)
+        self.packed = packed
+
+    #builds a compact mask from a full size (H, W) mask
+    @classmethod
+    def from_dense(cls, mask):
+        mask = np.asarray(mask, dtype=bool)
+        rows = np.flatnonzero(mask.any(axis=1))
+        if len(rows) == 0:
+            return cls(mask.shape, (0, 0, 0, 0), np.zeros(0, dtype=np.uint8))
+        cols = np.flatnonzero(mask[rows[0]:rows[-1] + 1].any(axis=0))
+
+        bounds = (rows[0], rows[-1] + 1, cols[0], cols[-1] + 1)
+        crop = mask[bounds[0]:bounds[1], bounds[2]:bounds[3]]
+        return cls(mask.shape, bounds, np.packbits(crop, axis=None))
+
+    @property
+    def is_empty(self):
+        y_min, y_max, x_min, x_max = self.bounds
+        return y_max <= y_min or x_max <= x_min
+
+    #height and width of the bounding box
+    @property
+    def crop_shape(self):
+        y_min, y_max, x_min, x_max = self.bounds
+        return (y_max - y_min, x_max - x_min)
+
+    #bounding box as (x_min, y_min, width, height)
+    @property
+    def bbox(self):
+        y_min, y_max, x_min, x_max = self.bounds
+        return (x_min, y_min, x_max - x_min, y_max - y_min)
+
+    @property
+    def nbytes(self):
+        return self.packed.nbytes
+
+    #slices selecting the bounding box from an image of the full shape
+    def window(self):
+        y_min, y_max, x_min, x_max = self.bounds
+        return (slice(y_min, y_max), slice(x_min, x_max))
+
+    #the boolean mask inside the bounding box
+    def crop(self):
+        h, w = self.crop_shape
+        return np.unpackbits(self.packed, count=h * w).reshape(h, w).astype(bool)
+
+    #the full size boolean mask
+    def to_dense(self):
+        dense = np.zeros(self.shape, dtype=bool)
+        if not self.is_empty:
+            dense[self.window()] = self.crop()
+        return dense
+
+    def area(self):
+        return int(np.unpackbits(self.packed).sum()) if not self.is_empty else 0
+
+    #run length encoding of the cropped mask, counts alternate starting with a run of zeros
+    def to_rle(self):
+        flat = self.crop().ravel() if not self.is_empty else np.zeros(0, dtype=bool)
+        changes = np.flatnonzero(np.diff(flat.astype(np.int8))) + 1
+        edges = np.concatenate(([0], changes, [len(flat)]))
+        counts = np.diff(edges).tolist()
+        if len(flat) and flat[0]:
+            counts = [0] + counts
+        return {"size": list(self.shape), "bounds": list(self.bounds), "counts": counts}
+
+    @classmethod
+    def from_rle(cls, rle):
+        bounds = rle["bounds"]
+        h, w = bounds[1] - bounds[0], bounds[3] - bounds[2]
+        flat = np.zeros(max(h, 0) * max(w, 0), dtype=bool)
+        position = 0
+        value = False
+        for count in rle["counts"]:
+            if value:
+                flat[position:position + count] = True
+            position += count
+            value = not value
+        return cls(rle["size"], bounds, np.packbits(flat, axis=None))
+
+
+#intersection over union of two compact masks of the same image, only their overlapping window is decoded
+def mask_iou(a, b):
+    if a.is_empty or b.is_empty:
+        return 0.0
+    y_min, x_min = max(a.bounds[0], b.bounds[0]), max(a.bounds[2], b.bounds[2])
+    y_max, x_max = min(a.bounds[1], b.bounds[1]), min(a.bounds[3], b.bounds[3])
+
+    intersection = 0
+    if y_max > y_min and x_max > x_min:
+        a_crop = a.crop()[y_min - a.bounds[0]:y_max - a.bounds[0], x_min - a.bounds[2]:x_max - a.bounds[2]]
+        b_crop = b.crop()[y_min - b.bounds[0]:y_max - b.bounds[0], x_min - b.bounds[2]:x_max - b.bounds[2]]
+        intersection = int(np.count_nonzero(a_crop & b_crop))
+
+    union = a.area() + b.area() - intersection
+    return intersection / union if union else 0.0
+
+
+#replaces the full size segmentation of each SAM2 mask with a compact mask
+def compact_masks(masks):
+    for mask in masks:
+        if not isinstance(mask["segmentation"], CompactMask):
+            mask["segmentation"] = CompactMask.from_dense(mask["segmentation"])
+    return masks
@@ -0,0 +1,133 @@
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from config import MODEL_REGISTRY_BUDGET_MB
+from inference_backends import load_model
+
+#this file keeps models loaded between uses so checkpoints are only read from disk once per process
+
+
+#estimates how much memory a loaded model is holding
+def estimate_model_bytes(model, model_path):
+    try:
+        module = getattr(model, "model", model)
+        tensors = list(module.parameters()) + list(module.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors)
+    except Exception:
+        # fall back on checkpoint size when the model does not expose its tensors
+        return os.path.getsize(model_path)
+
+
+#holds one entry of the registry
+class _RegistryEntry:
+    def __init__(self, model, size_bytes):
+        self.model = model
+        self.size_bytes = size_bytes
+        self.users = 0
+
+
+#process wide cache of loaded models with least recently used eviction under a memory budget
+class ModelRegistry:
+    def __init__(self, budget_mb=MODEL_REGISTRY_BUDGET_MB, loader=load_model):
+        self.budget_bytes = int(budget_mb * 1024 * 1024)
+        self.loader = loader
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self.loads = 0
+        self.hits = 0
+        self.evictions = 0
+
+    #returns the model for the path, loading it on first use
+    def get(self, model_path):
+        with self._lock:
+            entry = self._entries.get(model_path)
+            if entry is not None:
+                self.hits += 1
+                self._entries.move_to_end(model_path)
+                return entry.model
+
+            model = self.loader(model_path)
+            self.loads += 1
+            self._entries[model_path] = _RegistryEntry(model, estimate_model_bytes(model, model_path))
+            self._evict_over_budget(keep=model_path)
+            return model
+
+    #pins a model while it is being used so it cannot be evicted mid inference
+    @contextmanager
+    def use(self, model_path):
+        with self._lock:
+            model = self.get(model_path)
+            entry = self._entries[model_path]
+            entry.users += 1
+        try:
+            yield model
+        finally:
+            with self._lock:
+                entry.users -= 1
+                self._evict_over_budget()
+
+    #frees a single model
+    def evict(self, model_path):
+        with self._lock:
+            entry = self._entries.get(model_path)
+            if entry is None or entry.users > 0:
+                return False
+            del self._entries[model_path]
+            self.evictions += 1
+        self._release_memory()
+        return True
+
+    #frees every idle model
+    def clear(self):
+        with self._lock:
+            for model_path in list(self._entries):
+                self.evict(model_path)
+
+    #total estimated bytes held by loaded models
+    def memory_used(self):
+        with self._lock:
+            return sum(entry.size_bytes for entry in self._entries.values())
+
+    #paths of loaded models, least recently used first
+    def loaded(self):
+        with self._lock:
+            return list(self._entries)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "loaded": len(self._entries),
+                "memory_bytes": self.memory_used(),
+                "budget_bytes": self.budget_bytes,
+                "loads": self.loads,
+                "hits": self.hits,
+                "evictions": self.evictions,
+            }
+
+    # drops least recently used idle models until the registry fits the budget
+    def _evict_over_budget(self, keep=None):
+        freed = False
+        for model_path in list(self._entries):
+            if self.memory_used() <= self.budget_bytes:
+                break
+            entry = self._entries[model_path]
+            if model_path == keep or entry.users > 0:
+                continue
+            del self._entries[model_path]
+            self.evictions += 1
+            freed = True
+        if freed:
+            self._release_memory()
+
+    def _release_memory(self):
+        try:
+            import torch
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        except ImportError:
+            pass
+
+
+#singleton instance of the registry
+model_registry = ModelRegistry()
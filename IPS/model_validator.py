@@ -1,5 +1,6 @@
 import db
 from config import WORKING_DIR
+from dataset_manifest import materialize_dataset
 from ultralytics import YOLO
 
 # Validates a model against a dataset
@@ -10,7 +11,7 @@ def validate_model(model_name, dataset_name, worker_thread):
 
     worker_thread.status_update.emit("Loading Dataset:")
     dataset_id = db.get_dataset_id(dataset_name)
-    db.load_dataset(dataset_id)
+    materialize_dataset(dataset_id)
     worker_thread.status_update.emit("Dataset Loaded:")
 
 
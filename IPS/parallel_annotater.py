@@ -0,0 +1,131 @@
+import multiprocessing
+import os
+import queue
+import traceback
+from config import ANNOTATION_SHARD_SIZE, PIPELINE_QUEUE_DEPTH, PREFETCH_DEPTH, PREFETCH_WORKERS
+
+#this file spreads annotation over several worker processes so every CPU core is used when there is no GPU
+#each worker loads SAM2 and the tree ensemble once, then keeps asking for shards of image paths until none are left
+#workers only compute annotations, the calling process stays the single writer of uploads, removals and the journal
+#nothing heavy is imported at module level since every spawned worker imports this file first
+
+
+#threads each worker may use so the workers together fill the machine without oversubscribing it
+def threads_for(workers, threads_per_worker=0):
+    if threads_per_worker > 0:
+        return threads_per_worker
+    return max(1, (os.cpu_count() or 1) // workers)
+
+#limits the thread pools of the numeric libraries, must run before torch, numpy or cv2 are imported
+def limit_threads(threads):
+    for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "NUMEXPR_NUM_THREADS"):
+        os.environ[name] = str(threads)
+
+    import cv2
+    import torch
+    torch.set_num_threads(threads)
+    cv2.setNumThreads(threads)
+
+#splits image paths into shards of shard_size
+def make_shards(image_paths, shard_size=ANNOTATION_SHARD_SIZE):
+    return [image_paths[i:i + shard_size] for i in range(0, len(image_paths), shard_size)]
+
+
+#body of a worker process, results go back to the parent as (kind, worker, payload) messages
+def _worker_main(worker, tasks, results, threads, preset, use_cache, use_embedding_cache, queue_depth, prefetch_depth, prefetch_workers):
+    try:
+        limit_threads(threads)
+        from dataset_annotater import AnnotationContext, annotate_images
+
+        context = AnnotationContext(preset, use_cache, use_embedding_cache)
+        try:
+            while True:
+                shard = tasks.get()
+                if shard is None:
+                    break
+                annotate_images(context, shard, lambda item: results.put(("result", worker, item)),
+                                queue_depth=queue_depth, prefetch_depth=prefetch_depth, prefetch_workers=prefetch_workers)
+        finally:
+            context.close()
+        results.put(("stats", worker, context.stats()))
+    except BaseException:
+        results.put(("error", worker, traceback.format_exc()))
+    results.put(("done", worker, None))
+
+
+#annotates image_paths with a pool of worker processes, on_result is called in this process for every annotated image
+#images the journal already holds verified annotations for are uploaded straight away without going to a worker
+#returns the summed counters of all workers
+def annotate_in_processes(image_paths, on_result, journal=None, preset=None, workers=2, threads_per_worker=0,
+                          use_cache=True, use_embedding_cache=True, shard_size=ANNOTATION_SHARD_SIZE,
+                          queue_depth=PIPELINE_QUEUE_DEPTH, prefetch_depth=PREFETCH_DEPTH, prefetch_workers=PREFETCH_WORKERS):
+    stats = {}
+
+    remaining = []
+    for image_path in image_paths:
+        annotations = journal.pending_annotations(image_path) if journal is not None else None
+        if annotations is not None:
+            on_result({"image_path": image_path, "annotations": annotations})
+        else:
+            remaining.append(image_path)
+    if not remaining:
+        return stats
+
+    shards = make_shards(remaining, shard_size)
+    workers = max(1, min(workers, len(shards)))
+    threads = threads_for(workers, threads_per_worker)
+
+    # exports the ensemble once here rather than in every worker at the same time
+    from inference_backends import prepare_models
+    from tree_verifier import TREE_MODEL_PATHS
+    prepare_models(TREE_MODEL_PATHS)
+
+    # spawn so workers never inherit CUDA or Qt state from this process
+    context = multiprocessing.get_context("spawn")
+    tasks = context.Queue()
+    results = context.Queue(maxsize=max(1, queue_depth) * workers)
+    for shard in shards:
+        tasks.put(shard)
+    for _ in range(workers):
+        tasks.put(None)
+
+    processes = []
+    for worker in range(workers):
+        process = context.Process(
+            target=_worker_main,
+            args=(worker, tasks, results, threads, preset, use_cache, use_embedding_cache, queue_depth, prefetch_depth, prefetch_workers),
+            daemon=True,
+        )
+        process.start()
+        processes.append(process)
+    print(f"Annotating {len(remaining)} images with {workers} worker processes, {threads} threads each")
+
+    finished = set()
+    try:
+        while len(finished) < workers:
+            try:
+                kind, worker, payload = results.get(timeout=1)
+            except queue.Empty:
+                for worker, process in enumerate(processes):
+                    if worker not in finished and not process.is_alive():
+                        raise Exception(f"Annotation worker {worker} exited unexpectedly with code {process.exitcode}")
+                continue
+
+            if kind == "result":
+                if journal is not None:
+                    journal.record(payload["image_path"], "verified", payload["annotations"])
+                on_result(payload)
+            elif kind == "stats":
+                for name, value in payload.items():
+                    stats[name] = stats.get(name, 0) + value
+            elif kind == "error":
+                raise Exception(f"Annotation worker {worker} failed:\n{payload}")
+            elif kind == "done":
+                finished.add(worker)
+    finally:
+        for process in processes:
+            if process.is_alive() and len(finished) < workers:
+                process.terminate()
+            process.join()
+
+    return stats
@@ -0,0 +1,126 @@
+import queue
+import threading
+
+#this file runs a chain of processing stages on separate threads joined by bounded queues
+#each stage only ever holds a few items so memory depends on the queue depth, not the number of items
+
+
+# marks the end of the stream between stages
+_DONE = object()
+
+
+#a single step of the pipeline
+class Stage:
+    def __init__(self, name, fn, batch_size=1):
+        self.name = name
+        self.fn = fn
+        self.batch_size = batch_size
+
+
+#runs items from a source through every stage, with stages overlapping on their own threads
+class Pipeline:
+    def __init__(self, source, depth=2):
+        self.source = source
+        self.depth = depth
+        self.stages = []
+        self._error = None
+        self._stop = threading.Event()
+
+    #adds a stage, fn takes an item and returns the item for the next stage or None to drop it
+    #stages with a batch size take a list of up to that many items and return a list
+    def add_stage(self, name, fn, batch_size=1):
+        self.stages.append(Stage(name, fn, batch_size))
+        return self
+
+    #runs the pipeline to completion, re-raising the first error a stage hit
+    def run(self):
+        queues = [queue.Queue(maxsize=self.depth) for _ in range(len(self.stages) + 1)]
+
+        threads = [threading.Thread(target=self._feed, args=(queues[0],), name="pipeline-source", daemon=True)]
+        for index, stage in enumerate(self.stages):
+            threads.append(threading.Thread(
+                target=self._run_stage,
+                args=(stage, queues[index], queues[index + 1]),
+                name=f"pipeline-{stage.name}",
+                daemon=True,
+            ))
+        for thread in threads:
+            thread.start()
+
+        # drain the final queue so the last stage never blocks
+        while True:
+            item = queues[-1].get()
+            if item is _DONE:
+                break
+
+        for thread in threads:
+            thread.join()
+
+        if self._error is not None:
+            raise self._error
+
+    def _feed(self, output):
+        try:
+            for item in self.source:
+                if self._stop.is_set():
+                    break
+                self._put(output, item)
+        except Exception as e:
+            self._fail(e)
+        finally:
+            output.put(_DONE)
+
+    def _run_stage(self, stage, input, output):
+        done = False
+        try:
+            while not done:
+                item = input.get()
+                if item is _DONE:
+                    break
+
+                if stage.batch_size == 1:
+                    if self._stop.is_set():
+                        continue
+                    result = stage.fn(item)
+                    if result is not None:
+                        self._put(output, result)
+                    continue
+
+                # take whatever else is already waiting, up to the batch size, without stalling the stream
+                batch = [item]
+                while len(batch) < stage.batch_size:
+                    try:
+                        item = input.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is _DONE:
+                        done = True
+                        break
+                    batch.append(item)
+
+                if self._stop.is_set():
+                    continue
+                for result in stage.fn(batch) or []:
+                    if result is not None:
+                        self._put(output, result)
+        except Exception as e:
+            self._fail(e)
+            # keep draining so upstream stages are never left blocked on a full queue
+            while not done and input.get() is not _DONE:
+                pass
+        finally:
+            output.put(_DONE)
+
+    # puts an item on a queue, giving up if another stage has failed
+    def _put(self, output, item):
+        while not self._stop.is_set():
+            try:
+                output.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _fail(self, error):
+        if self._error is None:
+            self._error = error
+        self._stop.set()
@@ -0,0 +1,103 @@
+import argparse
+import os
+import time
+import torch
+import dataset_annotater
+from image_loader import load_image
+from inference_backends import select_device
+from mask_codec import compact_masks, mask_iou
+from sam2_presets import SAM2_PRESETS
+
+#this file measures the SAM2 presets against each other so a preset can be picked with data
+#run from the IPS folder: python preset_benchmark.py --images <folder of photos> --limit 50
+
+
+#finds the images to benchmark on
+def find_images(image_dir, limit):
+    extensions = ('.jpg', '.jpeg', '.png', '.bmp')
+    paths = []
+    for root, dirs, files in os.walk(image_dir):
+        for file in sorted(files):
+            if file.lower().endswith(extensions):
+                paths.append(os.path.join(root, file))
+    paths.sort()
+    return paths[:limit] if limit else paths
+
+#runs a preset over the images, returns seconds per image and the kept masks of each image
+def run_preset(sam2_model, preset, images, filtered):
+    mask_generator = dataset_annotater.create_sam2_mask_generator(sam2_model, preset)
+    device = select_device()
+
+    def generate(image_rgb):
+        with torch.amp.autocast(device_type=device, dtype=torch.float16, enabled=device == "cuda"):
+            masks = mask_generator.generate(image_rgb)
+        if filtered:
+            masks = dataset_annotater.filter_masks(masks, min_area=300, max_masks=15)
+        return compact_masks(masks)
+
+    # warm up so one off setup cost is not counted against the first preset
+    generate(images[0])
+    if device == "cuda":
+        torch.cuda.synchronize()
+
+    results = []
+    start = time.perf_counter()
+    for image_rgb in images:
+        results.append([mask["segmentation"] for mask in generate(image_rgb)])
+    if device == "cuda":
+        torch.cuda.synchronize()
+    seconds_per_image = (time.perf_counter() - start) / len(images)
+
+    return seconds_per_image, results
+
+#fraction of reference masks that a preset found a mask for with at least iou_thresh overlap
+def mask_recall(reference, candidate, iou_thresh):
+    matched = 0
+    total = 0
+    for reference_masks, candidate_masks in zip(reference, candidate):
+        for reference_mask in reference_masks:
+            total += 1
+            if any(mask_iou(reference_mask, mask) >= iou_thresh for mask in candidate_masks):
+                matched += 1
+    return matched / total if total else 1.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure speed and mask recall of the SAM2 presets")
+    parser.add_argument("--images", required=True, help="folder of images to benchmark on")
+    parser.add_argument("--limit", type=int, default=50, help="max number of images to use, 0 for all")
+    parser.add_argument("--presets", nargs="+", default=list(SAM2_PRESETS), choices=list(SAM2_PRESETS))
+    parser.add_argument("--reference", default="accurate", choices=list(SAM2_PRESETS), help="preset recall is measured against")
+    parser.add_argument("--iou", type=float, default=0.5, help="IoU a mask needs to count as found")
+    parser.add_argument("--unfiltered", action="store_true", help="compare every generated mask instead of the ones annotate_dataset keeps")
+    args = parser.parse_args()
+
+    paths = find_images(args.images, args.limit)
+    images = [image for image in (load_image(path) for path in paths) if image is not None]
+    if not images:
+        raise Exception(f"No readable images found in {args.images}")
+
+    sam2_model = dataset_annotater.setup_sam2_model()
+    filtered = not args.unfiltered
+
+    presets = list(dict.fromkeys([args.reference] + args.presets))
+    timings = {}
+    masks = {}
+    for preset in presets:
+        print(f"Running preset {preset} on {len(images)} images")
+        timings[preset], masks[preset] = run_preset(sam2_model, preset, images, filtered)
+
+    print()
+    print(f"SAM2 presets on {len(images)} images, device {select_device()}, recall at IoU {args.iou} against {args.reference}")
+    print()
+    print("| preset | prompts / image | s / image | masks / image | mask recall |")
+    print("|---|---|---|---|---|")
+    for preset in args.presets:
+        prompts = SAM2_PRESETS[preset]["points_per_side"] ** 2
+        masks_per_image = sum(len(image_masks) for image_masks in masks[preset]) / len(images)
+        recall = mask_recall(masks[args.reference], masks[preset], args.iou)
+        print(f"| {preset} | {prompts} | {timings[preset]:.3f} | {masks_per_image:.1f} | {recall:.3f} |")
+
+
+if __name__ == "__main__":
+    main()
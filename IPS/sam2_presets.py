@@ -0,0 +1,34 @@
+#this file holds the SAM2 mask generator presets, kept apart from dataset_annotater so forms can list them without loading torch
+
+# named speed / quality trade offs for the SAM2 mask generator, preset_benchmark.py measures them
+# points_per_side sets the number of prompts per image (points_per_side squared)
+SAM2_PRESETS = {
+    "fast": {
+        "points_per_side": 16,
+        "points_per_batch": 64,
+        "pred_iou_thresh": 0.88,
+        "stability_score_thresh": 0.85,
+    },
+    "balanced": {
+        "points_per_side": 32,
+        "points_per_batch": 32,
+        "pred_iou_thresh": 0.85,
+        "stability_score_thresh": 0.8,
+    },
+    "accurate": {
+        "points_per_side": 48,
+        "points_per_batch": 64,
+        "pred_iou_thresh": 0.8,
+        "stability_score_thresh": 0.75,
+    },
+}
+DEFAULT_SAM2_PRESET = "balanced"
+
+# generator settings shared by every preset
+SAM2_SHARED_SETTINGS = {
+    "crop_n_layers": 0,  # Keep 0 for memory efficiency
+    "crop_overlap_ratio": 0.3,
+    "min_mask_region_area": 350,
+    "crop_n_points_downscale_factor": 2,
+    "box_nms_thresh": 0.7,
+}
@@ -0,0 +1,210 @@
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+from config import SHARD_DIR, REMOVAL_BATCH_SIZE
+from job_journal import JobJournal, photo_id_from_path
+from file_utils import write_json_atomic
+
+#this file splits the annotation of one dataset across several nodes
+#photos are assigned to shards by a stable hash of their photo id, so a shard always holds the same photos
+#and the shard of a failed node can be run again on its own
+#each node annotates its shard and writes a report, the merge step then removes the photos no trees were found in
+#from the dataset and totals the reports
+#run from the IPS folder:
+#   python shard_annotater.py run --dataset <id> --shard 0/4      on each node, one shard each
+#   python shard_annotater.py merge --dataset <id> --shards 4     once every shard has finished
+#   python shard_annotater.py local --dataset <id> --shards 4     runs every shard as a local process then merges
+#shard_simulation.py runs the same steps offline, with stand ins for the models and the DMS
+
+
+#parses "index/count" into (index, count)
+def parse_shard(text):
+    try:
+        index, count = (int(part) for part in text.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"shard must look like index/count, got {text!r}")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"shard index must be between 0 and {count - 1}, got {text!r}")
+    return index, count
+
+#shard a photo belongs to, the same on every node and every run
+def shard_of(photo_id, count):
+    return int(hashlib.sha1(str(photo_id).encode()).hexdigest()[:16], 16) % count
+
+#image paths of one shard, ordered by photo id
+def select_shard(image_paths, index, count):
+    paths = sorted(image_paths, key=photo_id_from_path)
+    return [path for path in paths if shard_of(photo_id_from_path(path), count) == index]
+
+#journal name of a shard job
+def shard_name(dataset_id, index, count):
+    return f"{dataset_id}.shard-{index}-of-{count}"
+
+def shard_report_path(dataset_id, index, count, root=SHARD_DIR):
+    return os.path.join(root, str(dataset_id), f"shard-{index}-of-{count}.json")
+
+
+#writes what a shard did, read back by merge_shards
+def write_shard_report(dataset_id, shard, journal, stats, elapsed, root=SHARD_DIR):
+    index, count = shard
+    report = {
+        "dataset_id": dataset_id,
+        "shard": [index, count],
+        "complete": journal.complete,
+        "uploaded": journal.photo_ids("uploaded"),
+        "removed": journal.photo_ids("removed"),
+        "stats": stats,
+        "elapsed": elapsed,
+    }
+    path = shard_report_path(dataset_id, index, count, root)
+    write_json_atomic(path, report, indent=2)
+    return path
+
+#reads the reports of every shard, raises naming the shards that still have to run
+def load_shard_reports(dataset_id, count, root=SHARD_DIR):
+    reports = []
+    missing = []
+    for index in range(count):
+        path = shard_report_path(dataset_id, index, count, root)
+        if not os.path.exists(path):
+            missing.append(index)
+            continue
+        with open(path, encoding="utf-8") as f:
+            report = json.load(f)
+        if not report.get("complete"):
+            missing.append(index)
+            continue
+        reports.append(report)
+
+    if missing:
+        shards = ", ".join(f"{index}/{count}" for index in missing)
+        raise Exception(f"Shards not finished for dataset {dataset_id}: {shards}")
+    return reports
+
+
+#journal name of the merge of a set of shard reports
+#keyed by the report contents so merging the same reports again resumes, while reports of a later run start a new merge
+def merge_name(dataset_id, count, reports):
+    digest = hashlib.sha1(json.dumps(reports, sort_keys=True).encode()).hexdigest()[:16]
+    return f"{dataset_id}.merge-{count}-{digest}"
+
+#removes the photos every shard found no trees in from the dataset and totals the shard reports
+#removals are journaled, so a merge that stops part way can be run again
+def merge_shards(dataset_id, count, progress_callback=None, root=SHARD_DIR):
+    import db
+
+    def report(message):
+        if progress_callback is not None:
+            progress_callback(message, False)
+        else:
+            print(message)
+
+    reports = load_shard_reports(dataset_id, count, root)
+
+    totals = {"uploaded": 0, "removed": 0, "elapsed": 0.0, "stats": {}}
+    removed = []
+    seen = set()
+    for shard_report in reports:
+        index = shard_report["shard"][0]
+        for photo_id in shard_report["uploaded"] + shard_report["removed"]:
+            if shard_of(photo_id, count) != index:
+                raise Exception(f"Photo {photo_id} reported by shard {index}/{count} belongs to another shard")
+            if photo_id in seen:
+                raise Exception(f"Photo {photo_id} reported by more than one shard")
+            seen.add(photo_id)
+
+        removed.extend(shard_report["removed"])
+        totals["uploaded"] += len(shard_report["uploaded"])
+        totals["removed"] += len(shard_report["removed"])
+        totals["elapsed"] = max(totals["elapsed"], shard_report["elapsed"])
+        for name, value in shard_report["stats"].items():
+            totals["stats"][name] = totals["stats"].get(name, 0) + value
+
+    journal = JobJournal(dataset_id, name=merge_name(dataset_id, count, reports))
+    try:
+        if journal.complete:
+            report(f"Removals of these shard reports were already sent to dataset {dataset_id}")
+        else:
+            journal.start({"shards": count})
+            pending = [photo_id for photo_id in sorted(removed) if not journal.is_done(photo_id)]
+            report(f"Removing {len(pending)} photos without trees from dataset {dataset_id}")
+            for start in range(0, len(pending), REMOVAL_BATCH_SIZE):
+                batch = pending[start:start + REMOVAL_BATCH_SIZE]
+                try:
+                    db.remove_photos_from_dataset(dataset_id, batch)
+                except db.PartialBatchError as e:
+                    # journal the photos that were removed so running the merge again only sends the rest
+                    remaining = set(e.remaining)
+                    for photo_id in batch:
+                        if photo_id not in remaining:
+                            journal.record(photo_id, "removed")
+                    raise
+                for photo_id in batch:
+                    journal.record(photo_id, "removed")
+            journal.mark_complete()
+    finally:
+        journal.close()
+
+    write_json_atomic(os.path.join(root, str(dataset_id), f"merged-{count}.json"), totals, indent=2)
+    report(f"Merged {count} shards: {totals['uploaded']} photos annotated, {totals['removed']} removed, "
+           f"slowest shard {totals['elapsed']:.1f} seconds")
+    return totals
+
+
+def _print_progress(message, finished):
+    print(message, flush=True)
+
+#runs every shard as its own local process then merges them, simulates a multi node run on one machine
+#command: start of the command each shard runs, --dataset and --shard are added to it
+def run_local(dataset_id, count, preset=None, command=None):
+    command = command or [sys.executable, os.path.abspath(__file__), "run"]
+    processes = []
+    for index in range(count):
+        shard_command = command + ["--dataset", str(dataset_id), "--shard", f"{index}/{count}"]
+        if preset:
+            shard_command += ["--preset", preset]
+        processes.append(subprocess.Popen(shard_command))
+
+    failed = [index for index, process in enumerate(processes) if process.wait() != 0]
+    if failed:
+        shards = ", ".join(f"{index}/{count}" for index in failed)
+        raise Exception(f"Shards failed, run them again with --shard: {shards}")
+    return merge_shards(dataset_id, count, _print_progress)
+
+
+def main():
+    from sam2_presets import SAM2_PRESETS, DEFAULT_SAM2_PRESET
+
+    parser = argparse.ArgumentParser(description="Annotate one dataset across several nodes")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="annotate one shard of a dataset")
+    run_parser.add_argument("--dataset", required=True, help="id of the dataset")
+    run_parser.add_argument("--shard", required=True, type=parse_shard, help="index/count, e.g. 0/4")
+    run_parser.add_argument("--preset", default=DEFAULT_SAM2_PRESET, choices=list(SAM2_PRESETS))
+
+    merge_parser = commands.add_parser("merge", help="finish a dataset once every shard has run")
+    merge_parser.add_argument("--dataset", required=True, help="id of the dataset")
+    merge_parser.add_argument("--shards", required=True, type=int, help="number of shards the dataset was split into")
+
+    local_parser = commands.add_parser("local", help="run every shard as a local process, then merge")
+    local_parser.add_argument("--dataset", required=True, help="id of the dataset")
+    local_parser.add_argument("--shards", required=True, type=int, help="number of shards to split the dataset into")
+    local_parser.add_argument("--preset", default=DEFAULT_SAM2_PRESET, choices=list(SAM2_PRESETS))
+
+    args = parser.parse_args()
+
+    if args.command == "run":
+        import dataset_annotater
+        dataset_annotater.annotate_dataset(args.dataset, _print_progress, preset=args.preset, shard=args.shard)
+    elif args.command == "merge":
+        merge_shards(args.dataset, args.shards, _print_progress)
+    else:
+        run_local(args.dataset, args.shards, args.preset)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+import argparse
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import types
+import config
+
+#this file checks the shard workflow offline, with no DMS and no model checkpoints
+#every shard runs as its own process through run_local and goes through the real annotate_dataset shard branch,
+#only the models and the DMS are replaced: the stand in models decide from a hash of the photo id whether trees
+#were found, and the stand in DMS records what it is sent
+#two runs over the same dataset id are simulated, the second with photos added after the first finished
+#needs the packages annotate_dataset imports (torch, numpy, cv2) but no GPU, checkpoints or DMS
+#run from the IPS folder: python shard_simulation.py --photos 200 --shards 4
+
+#the modules that read journal and report folders from config are imported after configure() points them at root
+
+
+DATASET_ID = "simulated"
+CLASSES = ["tree"]
+
+
+#points the journal and shard report folders at root, must run before job_journal or shard_annotater are imported
+def configure(root):
+    config.JOURNAL_DIR = os.path.join(root, "journals")
+    config.SHARD_DIR = os.path.join(root, "shards")
+
+
+#true for the photos the stand in models find trees in, about two in three
+def has_trees(photo_id):
+    return int(hashlib.sha1(f"trees:{photo_id}".encode()).hexdigest()[:8], 16) % 3 != 0
+
+def photo_ids(first, count):
+    return [f"{number:06d}" for number in range(first, first + count)]
+
+#writes an empty image file per photo, laid out the way the DMS loads a dataset
+def make_dataset(dataset_path, ids):
+    folder = os.path.join(dataset_path, "images", "train")
+    os.makedirs(folder, exist_ok=True)
+    for photo_id in ids:
+        open(os.path.join(folder, f"{photo_id}.jpg"), "wb").close()
+
+
+def check(condition, message):
+    if not condition:
+        raise Exception(f"Shard simulation failed: {message}")
+
+
+######################## Stand ins ########################
+
+#stand in for the db module, records what the DMS is sent
+def fake_db(dataset_path=None):
+    module = types.ModuleType("db")
+    module.uploaded = []
+    module.removed = []
+    module.TransientDMSError = type("TransientDMSError", (Exception,), {})
+    module.PartialBatchError = type("PartialBatchError", (Exception,), {})
+    module.TRANSIENT_ERRORS = (module.TransientDMSError,)
+
+    module.load_dataset_photos = lambda dataset_id: dataset_path
+    module.get_classes = lambda dataset_id: list(CLASSES)
+    module.get_annotation_classes = lambda ids: {photo_id: [] for photo_id in ids}
+    module.upload_annotations_batch = lambda entries: module.uploaded.extend(entry["photo_id"] for entry in entries)
+    module.remove_photos_from_dataset = lambda dataset_id, ids: module.removed.extend(ids)
+    return module
+
+#stand in for AnnotationContext, loads no models
+class FakeAnnotationContext:
+    def __init__(self, preset=None, use_cache=False, use_embedding_cache=False):
+        self.images = 0
+
+    def stats(self):
+        return {"images": self.images}
+
+    def close(self):
+        pass
+
+#stand in for annotate_images, finds trees in the photos has_trees picks
+def fake_annotate_images(context, image_paths, on_result, journal=None, *args, **kwargs):
+    from job_journal import photo_id_from_path
+
+    for image_path in image_paths:
+        context.images += 1
+        annotations = ["0 0.500000 0.500000 0.100000 0.100000"] if has_trees(photo_id_from_path(image_path)) else []
+        if journal is not None:
+            journal.record(image_path, "verified", annotations)
+        on_result({"image_path": image_path, "annotations": annotations})
+
+
+######################## Shard process ########################
+
+#annotates one shard through annotate_dataset with the stand ins, then checks what it sent and deleted
+def run_shard(dataset_id, shard, root, first, photos):
+    configure(root)
+    index, count = shard
+    dataset_path = os.path.join(root, "nodes", f"run-{first}", str(index))
+    ids = photo_ids(first, photos)
+    make_dataset(dataset_path, ids)
+
+    db = fake_db(dataset_path)
+    sys.modules["db"] = db
+    import dataset_annotater
+    from shard_annotater import shard_of
+
+    dataset_annotater.AnnotationContext = FakeAnnotationContext
+    dataset_annotater.annotate_images = fake_annotate_images
+    dataset_annotater.annotate_dataset(dataset_id, lambda message, finished: print(message, flush=True), shard=shard, workers=1)
+
+    mine = [photo_id for photo_id in ids if shard_of(photo_id, count) == index]
+    check(sorted(db.uploaded) == sorted(photo_id for photo_id in mine if has_trees(photo_id)),
+          f"shard {index}/{count} uploaded {len(db.uploaded)} annotations")
+    check(not db.removed, f"shard {index}/{count} removed photos from the DMS, that is left to the merge step")
+    for photo_id in ids:
+        present = os.path.exists(os.path.join(dataset_path, "images", "train", f"{photo_id}.jpg"))
+        deleted = photo_id in mine and not has_trees(photo_id)
+        check(present != deleted, f"shard {index}/{count} {'kept' if present else 'deleted'} the local copy of {photo_id}")
+
+
+######################## Driver ########################
+
+#runs every shard of one run as local processes, merges them and checks what the DMS was sent
+def simulate_run(db, root, first, photos, shards):
+    import shard_annotater
+
+    command = [sys.executable, os.path.abspath(__file__), "shard", "--root", root, "--first", str(first), "--photos", str(photos)]
+    db.removed.clear()
+    totals = shard_annotater.run_local(DATASET_ID, shards, command=command)
+
+    without_trees = sorted(photo_id for photo_id in photo_ids(first, photos) if not has_trees(photo_id))
+    check(totals["uploaded"] + totals["removed"] == photos, f"{totals['uploaded'] + totals['removed']} of {photos} photos reported")
+    check(totals["removed"] == len(without_trees), f"{totals['removed']} photos reported removed, expected {len(without_trees)}")
+    check(sorted(db.removed) == without_trees, f"DMS was sent {len(db.removed)} removals, expected {len(without_trees)}")
+
+
+def simulate(photos, shards, root):
+    configure(root)
+    db = fake_db()
+    sys.modules["db"] = db
+    import shard_annotater
+
+    print(f"Run 1: {photos} photos in {shards} shards")
+    simulate_run(db, root, 0, photos, shards)
+
+    print("Merging the same reports again")
+    db.removed.clear()
+    shard_annotater.merge_shards(DATASET_ID, shards)
+    check(not db.removed, f"DMS was sent {len(db.removed)} removals for reports that were already merged")
+
+    print(f"Run 2: {photos} photos added since run 1")
+    simulate_run(db, root, photos, photos, shards)
+
+    print("Shard simulation passed")
+
+
+def parse_shard(text):
+    from shard_annotater import parse_shard as parse
+    return parse(text)
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the shard workflow offline with stand ins for the models and the DMS")
+    commands = parser.add_subparsers(dest="command")
+
+    shard_parser = commands.add_parser("shard", help="run one simulated shard, started by run_local")
+    shard_parser.add_argument("--root", required=True)
+    shard_parser.add_argument("--first", type=int, required=True)
+    shard_parser.add_argument("--photos", type=int, required=True)
+    shard_parser.add_argument("--dataset", required=True)
+    shard_parser.add_argument("--shard", required=True)
+
+    parser.add_argument("--photos", type=int, default=200, help="photos in the simulated dataset")
+    parser.add_argument("--shards", type=int, default=4, help="number of shards, each runs as its own process")
+    parser.add_argument("--root", default=None, help="folder for the datasets, reports and journals, a temporary folder by default")
+    args = parser.parse_args()
+
+    if args.command == "shard":
+        configure(args.root)
+        run_shard(args.dataset, parse_shard(args.shard), args.root, args.first, args.photos)
+        return
+
+    root = args.root or tempfile.mkdtemp(prefix="shard_simulation_")
+    try:
+        simulate(args.photos, args.shards, root)
+    finally:
+        if args.root is None:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
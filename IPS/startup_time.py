@@ -0,0 +1,83 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+#this file measures how long the GUI takes from launch until the main window is shown
+#and checks that no heavy ML module was loaded on the way
+#it also checks the compiled main window is up to date with its .ui file, main.py only loads the compiled one
+#run from the IPS folder: python startup_time.py --runs 5
+#exits with 1 if the median startup time is over budget, a heavy module was imported or the compiled ui is stale
+
+# the gui base file and the module pyuic6 compiles it to, after editing the .ui recompile with:
+#   pyuic6 forms/ips_main_gui.ui -o forms/ips_main_gui_ui.py
+UI_FILE = "forms/ips_main_gui.ui"
+COMPILED_UI_FILE = "forms/ips_main_gui_ui.py"
+
+
+#the code lines of a pyuic6 output, its comments name the generator version and source path so are left out
+def ui_code(text):
+    return [line for line in text.splitlines() if line.strip() and not line.lstrip().startswith("#")]
+
+#true if compiling the .ui file now gives different code from the compiled module
+def ui_is_stale():
+    result = subprocess.run([sys.executable, "-m", "PyQt6.uic.pyuic", UI_FILE], capture_output=True, text=True, timeout=120)
+    if result.returncode != 0:
+        raise Exception(f"pyuic6 could not compile {UI_FILE}:\n{result.stderr}")
+    with open(COMPILED_UI_FILE) as f:
+        return ui_code(result.stdout) != ui_code(f.read())
+
+
+#launches main.py once, returns seconds from launch until the window showed and the heavy modules it loaded
+def measure_once():
+    env = dict(os.environ)
+    # no display is needed to measure
+    env.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+    launched = time.time()
+    result = subprocess.run([sys.executable, "main.py", "--startup-time"], env=env, capture_output=True, text=True, timeout=120)
+    if result.returncode != 0:
+        raise Exception(f"main.py exited with code {result.returncode}:\n{result.stderr}")
+
+    for line in reversed(result.stdout.splitlines()):
+        if line.startswith("{"):
+            report = json.loads(line)
+            return report["shown"] - launched, report["heavy_modules"]
+    raise Exception(f"main.py did not report its startup time:\n{result.stdout}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure GUI startup time")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=1.0, help="seconds the median startup may take")
+    args = parser.parse_args()
+
+    timings = []
+    heavy_modules = set()
+    for run in range(args.runs):
+        seconds, loaded = measure_once()
+        timings.append(seconds)
+        heavy_modules.update(loaded)
+        print(f"run {run + 1}: {seconds:.3f} seconds")
+
+    median = statistics.median(timings)
+    print(f"median {median:.3f} seconds, best {min(timings):.3f}, worst {max(timings):.3f}, budget {args.budget:.3f}")
+
+    failed = False
+    if ui_is_stale():
+        print(f"{COMPILED_UI_FILE} is out of date with {UI_FILE}, recompile it with pyuic6")
+        failed = True
+    if median > args.budget:
+        print("startup is over budget")
+        failed = True
+    if heavy_modules:
+        print(f"heavy modules loaded at startup: {', '.join(sorted(heavy_modules))}")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
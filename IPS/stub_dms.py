@@ -0,0 +1,172 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+import shutil
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from file_utils import file_checksum
+
+#this file is a local stand in for the DMS model endpoints so model uploads can be tried offline
+#it implements model creation, the chunked upload endpoints and the single request upload older DMS versions have
+#run from the IPS folder: python stub_dms.py --port 8000 --root /tmp/stub_dms
+#--fail-rate makes that share of chunk requests fail with 503 to exercise retries and resume
+
+
+#state of the stand in server, weights are kept under root
+class StubState:
+    def __init__(self, root, fail_rate=0.0):
+        self.root = root
+        self.fail_rate = fail_rate
+        self.lock = threading.Lock()
+        self.models = {}
+        self.uploads = {}
+        os.makedirs(os.path.join(root, "blobs"), exist_ok=True)
+        os.makedirs(os.path.join(root, "partial"), exist_ok=True)
+
+    def blob_path(self, sha256):
+        return os.path.join(self.root, "blobs", sha256)
+
+    def partial_path(self, upload_id):
+        return os.path.join(self.root, "partial", upload_id)
+
+    def received(self, upload_id):
+        path = self.partial_path(upload_id)
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    state = None
+
+    def _send(self, status, body=None):
+        data = json.dumps(body or {}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def _query(self):
+        return {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        state = self.state
+
+        if path == "/models":
+            doc = json.loads(self._body())
+            model_id = uuid.uuid4().hex
+            with state.lock:
+                state.models[model_id] = {"doc": doc, "weights": None}
+            self._send(200, {"id": model_id})
+
+        elif path == "/models/upload":
+            request = json.loads(self._body())
+            model_id, sha256 = request["model_id"], request["sha256"]
+            upload_id = hashlib.sha1(f"{model_id}:{sha256}".encode()).hexdigest()[:16]
+            with state.lock:
+                if model_id not in state.models:
+                    return self._send(404, {"detail": "unknown model"})
+                exists = os.path.exists(state.blob_path(sha256))
+                if exists:
+                    # identical weights were sent before, the model shares them
+                    state.models[model_id]["weights"] = state.blob_path(sha256)
+                state.uploads[upload_id] = {"model_id": model_id, "sha256": sha256, "size": request["size"]}
+                self._send(200, {"upload_id": upload_id, "received": state.received(upload_id), "exists": exists})
+
+        elif path == "/models/upload/complete":
+            upload_id = json.loads(self._body())["upload_id"]
+            with state.lock:
+                upload = state.uploads.get(upload_id)
+                if upload is None:
+                    return self._send(404, {"detail": "unknown upload"})
+                partial = state.partial_path(upload_id)
+                if not os.path.exists(state.blob_path(upload["sha256"])):
+                    if not os.path.exists(partial) or file_checksum(partial) != upload["sha256"]:
+                        if os.path.exists(partial):
+                            os.remove(partial)
+                        return self._send(400, {"detail": "checksum mismatch, upload again"})
+                    shutil.move(partial, state.blob_path(upload["sha256"]))
+                state.models[upload["model_id"]]["weights"] = state.blob_path(upload["sha256"])
+            self._send(200, {})
+
+        elif path == "/models/path":
+            # single request upload, the multipart body is stored as is
+            body = self._body()
+            with open(os.path.join(state.root, f"legacy-{uuid.uuid4().hex}"), "wb") as f:
+                f.write(body)
+            self._send(200, {})
+
+        else:
+            self._send(404, {"detail": "not found"})
+
+    def do_PUT(self):
+        path = urlparse(self.path).path
+        state = self.state
+        if path != "/models/upload/chunk":
+            return self._send(404, {"detail": "not found"})
+
+        query = self._query()
+        upload_id, offset = query["upload_id"], int(query["offset"])
+        chunk = self._body()
+        if random.random() < state.fail_rate:
+            return self._send(503, {"detail": "simulated failure"})
+
+        with state.lock:
+            if upload_id not in state.uploads:
+                return self._send(404, {"detail": "unknown upload"})
+            received = state.received(upload_id)
+            if offset != received:
+                return self._send(409, {"received": received})
+            with open(state.partial_path(upload_id), "ab") as f:
+                f.write(chunk)
+            self._send(200, {"received": received + len(chunk)})
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/models":
+            with self.state.lock:
+                models = [dict(model["doc"], id=model_id, base_model=False) for model_id, model in self.state.models.items()]
+            self._send(200, {"models": models})
+        else:
+            self._send(404, {"detail": "not found"})
+
+    def log_message(self, format, *args):
+        pass
+
+
+#builds the stand in server, weights are kept under root
+def make_stub_server(root, port=8000, fail_rate=0.0):
+    handler = type("Handler", (StubHandler,), {"state": StubState(root, fail_rate)})
+    return ThreadingHTTPServer(("127.0.0.1", port), handler)
+
+#starts the stand in server on a background thread, returns the server, call shutdown() on it when done
+def start_stub_server(root, port=8000, fail_rate=0.0):
+    server = make_stub_server(root, port, fail_rate)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand in for the DMS model upload endpoints")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--root", default="stub_dms", help="folder uploaded weights are kept in")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of chunk requests that fail with 503")
+    args = parser.parse_args()
+
+    server = make_stub_server(args.root, args.port, args.fail_rate)
+    print(f"Stub DMS listening on http://127.0.0.1:{args.port}, weights in {args.root}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-import db
+from dataset_manifest import materialize_dataset
 
 #this class holds variables that need to be accessed by wide range of forms 
 class System:
@@ -20,7 +20,8 @@ class Dataset:
     def  __init__(self, id,):
         self.id = id
        
-        db.load_dataset(id)  
+        # only fetches what is missing or changed in WORKING_DIR
+        materialize_dataset(id)
      
             
 
@@ -0,0 +1,209 @@
+import math
+import threading
+import time
+import cv2
+import numpy as np
+from config import VERIFY_BATCH_SIZE, CASCADE_VOTING, VERIFY_IMGSZ
+from model_registry import model_registry
+
+#this file runs the yolo ensemble that decides whether a mask crop contains a tree
+
+
+################# replace with api request once model deployment is complete ##########
+TREE_MODEL_PATHS = ["checkpoints/best_vX.pt","checkpoints/best_vM.pt","checkpoints/best_vL.pt","checkpoints/best_vS.pt"]
+CONF_THRESH = 0.4
+AGREEMENT_THRESHOLD = 0.25
+
+MODEL_STRIDE = 32
+
+# width / height ratios crops are grouped into so a batch shares one input shape
+ASPECT_BUCKETS = (1/3, 1/2, 2/3, 1.0, 3/2, 2.0, 3.0)
+
+
+#highest confidence tree detection in the results of one crop
+def tree_confidence(result, names):
+    best = 0.0
+    for box in result.boxes:
+        cls = int(box.cls[0])
+        conf = float(box.conf[0])
+        if names[cls].lower() == "tree" and conf > best:
+            best = conf
+    return best
+
+#decides if a crop contains a tree from the scores each model gave it
+def tree_vote(scores, conf_thresh=CONF_THRESH, agreement_threshold=AGREEMENT_THRESHOLD, total_models=None):
+    if total_models is None:
+        total_models = len(scores)
+    votes = sum(1 for score in scores.values() if score >= conf_thresh)
+    return votes / total_models >= agreement_threshold
+
+#fewest positive votes that reach the agreement threshold
+def votes_needed(total_models, agreement_threshold=AGREEMENT_THRESHOLD):
+    for votes in range(total_models + 1):
+        if votes / total_models >= agreement_threshold:
+            return votes
+    return total_models + 1
+
+#returns True or False once the vote can no longer change, None while it is still open
+def decided_vote(scores, total_models, conf_thresh=CONF_THRESH, agreement_threshold=AGREEMENT_THRESHOLD):
+    needed = votes_needed(total_models, agreement_threshold)
+    votes = sum(1 for score in scores.values() if score >= conf_thresh)
+    remaining = total_models - len(scores)
+    if votes >= needed:
+        return True
+    if votes + remaining < needed:
+        return False
+    return None
+
+
+#keeps a running average of how long each model takes per crop
+class ModelCostTracker:
+    def __init__(self, smoothing=0.2):
+        self.smoothing = smoothing
+        self._costs = {}
+        self._lock = threading.Lock()
+
+    def record(self, model_path, seconds, crops):
+        if crops == 0:
+            return
+        per_crop = seconds / crops
+        with self._lock:
+            previous = self._costs.get(model_path)
+            if previous is None:
+                self._costs[model_path] = per_crop
+            else:
+                self._costs[model_path] = previous + self.smoothing * (per_crop - previous)
+
+    def cost(self, model_path):
+        with self._lock:
+            return self._costs.get(model_path)
+
+    #cheapest models first, models that have not been measured yet keep their given order at the front
+    def order(self, model_paths):
+        indexed = list(enumerate(model_paths))
+        indexed.sort(key=lambda item: (self.cost(item[1]) is not None, self.cost(item[1]) or 0.0, item[0]))
+        return [model_path for _, model_path in indexed]
+
+model_costs = ModelCostTracker()
+
+
+#counts ensemble model invocations for a job, so the savings of cascade voting can be reported
+class CascadeStats:
+    def __init__(self):
+        self.crops = 0
+        self.invocations = 0
+        self.possible = 0
+
+    @property
+    def saved(self):
+        return self.possible - self.invocations
+
+    def as_dict(self):
+        return {"crops": self.crops, "invocations": self.invocations, "possible": self.possible}
+
+    #adds counts from another job, e.g. one reported back by a worker process
+    def add(self, counts):
+        self.crops += counts.get("crops", 0)
+        self.invocations += counts.get("invocations", 0)
+        self.possible += counts.get("possible", 0)
+
+    def summary(self):
+        return f"Ensemble ran {self.invocations} of {self.possible} model invocations on {self.crops} crops ({self.saved} saved by early exit)"
+
+
+#picks the aspect ratio bucket closest to the crop
+def aspect_bucket(crop):
+    h, w = crop.shape[:2]
+    ratio = w / h
+    return min(ASPECT_BUCKETS, key=lambda r: abs(math.log(ratio / r)))
+
+#input shape shared by every crop in a bucket, a multiple of the stride so letterboxing adds no padding
+def bucket_shape(aspect, imgsz=VERIFY_IMGSZ):
+    if aspect >= 1:
+        return max(MODEL_STRIDE, round(imgsz / aspect / MODEL_STRIDE) * MODEL_STRIDE), imgsz
+    return imgsz, max(MODEL_STRIDE, round(imgsz * aspect / MODEL_STRIDE) * MODEL_STRIDE)
+
+#pads a crop out to the bucket aspect ratio then scales it to the bucket shape
+#padding is black to match the background left by masking
+def fit_crop_to_bucket(crop, aspect, imgsz=VERIFY_IMGSZ):
+    h, w = crop.shape[:2]
+    if w / h < aspect:
+        padded_h, padded_w = h, max(w, round(h * aspect))
+    else:
+        padded_h, padded_w = max(h, round(w / aspect)), w
+
+    if (padded_h, padded_w) != (h, w):
+        canvas = np.zeros((padded_h, padded_w) + crop.shape[2:], dtype=crop.dtype)
+        top = (padded_h - h) // 2
+        left = (padded_w - w) // 2
+        canvas[top:top + h, left:left + w] = crop
+        crop = canvas
+
+    out_h, out_w = bucket_shape(aspect, imgsz)
+    return cv2.resize(crop, (out_w, out_h), interpolation=cv2.INTER_LINEAR)
+
+#groups crop indexes by aspect ratio bucket
+def bucket_crops(crops):
+    buckets = {}
+    for index, crop in enumerate(crops):
+        buckets.setdefault(aspect_bucket(crop), []).append(index)
+    return buckets
+
+
+#runs one model over a list of crops in batches, returns the tree confidence of each crop
+def score_with_model(model_path, crops, batch_size=VERIFY_BATCH_SIZE):
+    scores = []
+    with model_registry.use(model_path) as model:
+        for start in range(0, len(crops), batch_size):
+            batch = crops[start:start + batch_size]
+            began = time.perf_counter()
+            results = model(batch, imgsz=VERIFY_IMGSZ, verbose=False)
+            model_costs.record(model_path, time.perf_counter() - began, len(batch))
+            scores.extend(tree_confidence(result, model.names) for result in results)
+    return scores
+
+#scores every crop with every ensemble model, each model runs once per size bucket
+#in cascade mode models run cheapest first and a crop stops being scored once its vote is decided
+#initial_scores can hold scores already known for each crop (e.g. from the annotation cache), those models are not rerun
+#returns a list holding a {model_path: confidence} dict per crop
+def score_crops(crops, model_paths=TREE_MODEL_PATHS, batch_size=VERIFY_BATCH_SIZE, cascade=CASCADE_VOTING,
+                conf_thresh=CONF_THRESH, agreement_threshold=AGREEMENT_THRESHOLD, stats=None, initial_scores=None):
+    if initial_scores is None:
+        scores = [{} for _ in crops]
+    else:
+        scores = [dict(crop_scores) for crop_scores in initial_scores]
+    total_models = len(model_paths)
+    ordered_paths = model_costs.order(model_paths) if cascade else list(model_paths)
+
+    for aspect, indexes in bucket_crops(crops).items():
+        fitted = {}
+        for model_path in ordered_paths:
+            if cascade:
+                indexes = [i for i in indexes if decided_vote(scores[i], total_models, conf_thresh, agreement_threshold) is None]
+                if not indexes:
+                    break
+            to_run = [i for i in indexes if model_path not in scores[i]]
+            if not to_run:
+                continue
+            for i in to_run:
+                if i not in fitted:
+                    fitted[i] = fit_crop_to_bucket(crops[i], aspect)
+            bucket = [fitted[i] for i in to_run]
+            for i, score in zip(to_run, score_with_model(model_path, bucket, batch_size)):
+                scores[i][model_path] = score
+            if stats is not None:
+                stats.invocations += len(to_run)
+
+    if stats is not None:
+        stats.crops += len(crops)
+        stats.possible += len(crops) * total_models
+    return scores
+
+#determines which crops contain a tree, crops can come from one image or a window of several
+def is_tree_batch(crops, model_paths=TREE_MODEL_PATHS, conf_thresh=CONF_THRESH, agreement_threshold=AGREEMENT_THRESHOLD,
+                  cascade=CASCADE_VOTING, stats=None):
+    if not crops:
+        return []
+    scores = score_crops(crops, model_paths, cascade=cascade, conf_thresh=conf_thresh,
+                         agreement_threshold=agreement_threshold, stats=stats)
+    return [tree_vote(crop_scores, conf_thresh, agreement_threshold, len(model_paths)) for crop_scores in scores]
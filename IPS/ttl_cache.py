@@ -0,0 +1,73 @@
+import copy
+import functools
+import threading
+import time
+from config import METADATA_CACHE_TTL
+
+#this file caches results of DMS lookups that rarely change, such as model and dataset listings
+#entries expire after a time to live, and writes to the DMS invalidate the group of lookups they affect
+
+
+# group name -> caches invalidated together
+_groups = {}
+_caches = {}
+
+
+#results of one function keyed by its arguments
+class TTLCache:
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_call(self, key, fn):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                return copy.deepcopy(entry[1])
+            self.misses += 1
+
+        # errors are raised to the caller and never cached
+        value = fn()
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+        return copy.deepcopy(value)
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+
+#caches a function's results for ttl seconds, invalidate(group) drops them early
+def ttl_cached(group, ttl=METADATA_CACHE_TTL):
+    def decorator(fn):
+        cache = TTLCache(ttl)
+        _groups.setdefault(group, []).append(cache)
+        _caches[fn.__name__] = cache
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            key = (args, tuple(sorted(kwargs.items())))
+            return cache.get_or_call(key, lambda: fn(*args, **kwargs))
+
+        wrapper.cache = cache
+        return wrapper
+    return decorator
+
+#drops every cached result of the groups, all groups if none are given
+def invalidate(*groups):
+    for group in groups or list(_groups):
+        for cache in _groups.get(group, []):
+            cache.invalidate()
+
+#hits, misses and entries of every cached function
+def cache_stats():
+    return {name: cache.stats() for name, cache in _caches.items()}
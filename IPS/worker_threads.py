@@ -1,11 +1,13 @@
 import traceback
-from datetime import datetime
-import dataset_annotater
-import model_trainer
-import model_validator
 import db
 from PyQt6.QtCore import QThread, pyqtSignal
 from system import system_instance
+from sam2_presets import DEFAULT_SAM2_PRESET
+from job_journal import JobJournal
+from job_callbacks import TrainingCallbacks, ValidationCallbacks
+
+# dataset_annotater, model_trainer and model_validator pull in torch, ultralytics and cv2,
+# they are imported when a job starts so the GUI opens without loading them
 
 #this class handles dataset loading and creating
 #separate thread from GUI
@@ -18,13 +20,14 @@ class DatasetWorker(QThread):
         
         
   
-    def __init__(self, dataset_name, form_data = None, split = None, classes = None):
+    def __init__(self, dataset_name, form_data = None, split = None, classes = None, preset = DEFAULT_SAM2_PRESET):
         super().__init__()
         self.dataset_name = dataset_name
         self.form_data = form_data
         self.split = split
         self.annotating = False
         self.classes = classes
+        self.preset = preset
 
         if form_data is not None and split is not None:
 
@@ -35,12 +38,19 @@ class DatasetWorker(QThread):
 
         try: 
             if self.annotating:
+                import dataset_annotater
                 dataset_id = db.create_dataset(self.dataset_name, self.form_data, self.split, self.classes)
-                dataset_annotater.annotate_dataset(dataset_id, progress_callback=self.progress.emit)
+                dataset_annotater.annotate_dataset(dataset_id, progress_callback=self.progress.emit, preset=self.preset)
                 system_instance.change_dataset(dataset_id)
                 self.progress.emit("Dataset Creation Complete:",True)
             else:
                 dataset_id = db.get_dataset_id(self.dataset_name)
+
+                # finish annotating a dataset whose creation was interrupted before loading it
+                if JobJournal.has_unfinished(dataset_id):
+                    import dataset_annotater
+                    dataset_annotater.annotate_dataset(dataset_id, progress_callback=self.progress.emit)
+
                 system_instance.change_dataset(dataset_id)
                 self.progress.emit("Dataset Loaded", True)
             
@@ -53,7 +63,7 @@ class DatasetWorker(QThread):
 
 #this class handles model validation 
 #separate thread from GUI
-class ModelValidatorWorker(QThread):
+class ModelValidatorWorker(QThread, ValidationCallbacks):
 
     validation_finished = pyqtSignal(dict) # send final results
     status_update = pyqtSignal(str)  # Send general status updates 
@@ -67,38 +77,17 @@ class ModelValidatorWorker(QThread):
       
     def run(self):
         try:
+            import model_validator
             model_validator.validate_model(self.model_name,self.dataset_name,self)
         except Exception as e:
             
             tb_str = traceback.format_exc()
             print(tb_str)
-            self.error_occurred.emit(str(e)) 
-            
-
-
-    def on_val_start(self,trainer):
-        self.status_update.emit("Validation Started")
-
-    def on_val_end(self, trainer):
-        metrics = trainer.metrics
-
-        # Ensure metrics are available before accessing them
-        if not metrics:
-            print("No metrics found.")
-            return
-
-        results = {
-            "mAP50": metrics.box.map50,
-            "mAP50_95": metrics.box.map,
-            "recall": metrics.box.mr,
-            "precision": metrics.box.mp,
-        }
-
-        self.validation_finished.emit(results)
+            self.error_occurred.emit(str(e))
 
 #this class handles model training 
 #separate thread from GUI
-class ModelTrainerWorker(QThread):
+class ModelTrainerWorker(QThread, TrainingCallbacks):
     
 
     # Signals to communicate with main thread
@@ -112,20 +101,13 @@ class ModelTrainerWorker(QThread):
 
     def __init__(self,config):
         super().__init__()
-        self.config = config  
-        self.best_mAP50 = 0
-        self.current_epoch = 0 
-        self.best_fitness = 0
-
-        
-        self.total_epochs = self.config.get("epochs", 0)
-        if self.total_epochs == 0:
-            self.total_epochs = 100
+        self.reset_progress(config)
         
 
 
     def run(self):
         try: 
+            import model_trainer
 
             explicit_config = model_trainer.complete_config(self.config.copy())
             model_trainer.train_model(explicit_config, self)
@@ -135,105 +117,34 @@ class ModelTrainerWorker(QThread):
             
             tb_str = traceback.format_exc()
             print(tb_str)
-            self.error_occurred.emit(str(e)) 
+            self.error_occurred.emit(str(e))
 
 
-    def on_train_start(self,trainer):
-        """Called when training starts"""
-        self.start_time = datetime.now()
-        self.training_started.emit(f"Training started at {self.start_time.strftime('%H:%M:%S')}")
-        self.status_update.emit(f"Training for {self.total_epochs} epochs...")
+#this class handles saving a trained model to the DMS
+#separate thread from GUI so large weights upload without freezing it
+class ModelUploadWorker(QThread):
 
-    def on_train_epoch_end(self, trainer):
-        """Called at the end of each epoch"""
-        try:
-            # Extract metrics from trainer
-            metrics = trainer.metrics 
-            
-            # Get key metrics (handle missing keys gracefully)
-            mAP50 = metrics.get('metrics/mAP50(B)', 0)
-            mAP50_95 = metrics.get('metrics/mAP50-95(B)', 0)
-            precision = metrics.get('metrics/precision(B)', 0)
-            recall = metrics.get('metrics/recall(B)', 0)
-            box_loss = metrics.get('val/box_loss', 0)
-            cls_loss = metrics.get('val/cls_loss', 0)
-            fitness = trainer.fitness
-            
-            # Track best fitness
-            if fitness is not None and fitness > self.best_fitness:
-                self.best_fitness = fitness
-                is_best = True
-            else:
-                is_best = False
-            
-            # Calculate elapsed time
-            elapsed = datetime.now() - self.start_time if self.start_time else None
-            elapsed_str = str(elapsed).split('.')[0] if elapsed else "Unknown"
-            self.current_epoch += 1
-            # Create metrics dictionary
-            epoch_metrics = {
-                'best_fitness' : self.best_fitness,
-                'epoch': self.current_epoch ,
-                'total_epochs': self.total_epochs,
-                'mAP50': mAP50,
-                'mAP50_95': mAP50_95,
-                'precision': precision,
-                'recall': recall,
-                'fitness':fitness,
-                'box_loss': box_loss,
-                'cls_loss': cls_loss,
-                'is_best': is_best,
-                'elapsed_time': elapsed_str,
-                'progress_percent': ((self.current_epoch) / self.total_epochs) * 100
-            }
-            
-            # Send metrics to main thread
-            self.epoch_completed.emit(epoch_metrics)
-            
-            
-            
-        except Exception as e:
-            self.error_occurred.emit(f"Error processing epoch metrics: {str(e)}")
-    
-    def on_train_end(self, trainer):
-        """Called when training completes"""
-        try:
-            total_time = datetime.now() - self.start_time if self.start_time else None
-            total_time_str = str(total_time).split('.')[0] if total_time else "Unknown"
-            
-            # Get final results
-            results = {
-                'completed_epochs': self.current_epoch,
-                'best_fitness': self.best_fitness,
-                'total_time': total_time_str,
-                'model_path': getattr(trainer, 'save_dir', 'Unknown'),
-                'success': True
-            }
-            #send results to trainingDisplay
-            self.training_finished.emit(results)
-            
-            # Initialize metadata dictionary
-            metadata = {}
-
-            # Retrieve metrics from trainer
-            metrics = trainer.metrics
-            metadata["best_mAP50"] = self.best_mAP50
-            metadata['mAP50'] = metrics.get('metrics/mAP50(B)', 0) 
-            metadata['AP50_95'] = metrics.get('metrics/mAP50-95(B)', 0)
-            metadata['precision'] = metrics.get('metrics/precision(B)', 0)
-            metadata['recall'] = metrics.get('metrics/recall(B)', 0)
-
-
-            doc = {}
-            doc["results"] = metadata
-            name = self.config.pop("name")
-            doc['config'] = self.config
-            doc['name'] = name
-            doc ['dataset_id'] = system_instance.loaded_dataset.id
-            self.prepare_save.emit(doc)
+    progress = pyqtSignal(str)
+    finished_upload = pyqtSignal(str)
+    error_occurred = pyqtSignal(str)
 
-            
-            
-        except Exception as e:
-            self.error_occurred.emit(f"Error in training completion: {str(e)}")
+    def __init__(self, results_doc):
+        super().__init__()
+        self.results_doc = results_doc
+        self.last_percent = -1
 
+    def run(self):
+        try:
+            db.save_model(self.results_doc, progress_callback=self.on_progress)
+            self.finished_upload.emit(f"Model {self.results_doc['name']} saved")
+        except Exception as e:
+            tb_str = traceback.format_exc()
+            print(tb_str)
+            self.error_occurred.emit(str(e))
+
+    def on_progress(self, sent, total):
+        percent = int(sent * 100 / total) if total else 100
+        # one update per percent is plenty for the display
+        if percent != self.last_percent:
+            self.last_percent = percent
+            self.progress.emit(f"Uploading weights: {percent}% ({sent / 1e6:.1f} of {total / 1e6:.1f} MB)")